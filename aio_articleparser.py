@@ -2,6 +2,7 @@ from datetime import datetime
 from pathlib import Path
 import json
 import hashlib
+import mmap
 import enum
 from bs4 import BeautifulSoup
 import ssl
@@ -10,9 +11,18 @@ import aiofiles
 from difflib import SequenceMatcher
 from yarl import URL
 import asyncio
-import re
-import urllib
-import aiosqlite
+import os
+import time
+import aiohttp
+from aio_metadb import MetaDB
+from aio_eutils import EUtils
+from aio_crossref import Crossref
+from aio_parsepool import ParsePool
+from aio_blobstore import BlobStore
+from aio_download import Downloader
+from aio_http import RequestError
+from aio_sections import section_store
+from aio_throttle import HostLimiter, SingleFlight, backoff
 
 sslcontext = ssl.create_default_context(cafile=certifi.where())
 
@@ -72,10 +82,6 @@ class FileTypeError(Exception):
     pass
 
 
-class RequestError(Exception):
-    pass
-
-
 class AuthorizationError(Exception):
     pass
 
@@ -88,14 +94,87 @@ class ArticleError(Exception):
     pass
 
 
+def parse_unixsd(xml):
+    s = BeautifulSoup(xml, 'xml')
+    result = {'title': ' '.join(s.title.text.split()),
+              'journal': s.journal_metadata.full_title.text,
+              'date': None,
+              'authors': []}
+    for i in s.find_all('crm-item'):
+        if i['name'] == 'created':
+            result['date'] = datetime.fromisoformat(i.text[:-1]).isoformat()
+    for a in s.find_all('person_name'):
+        if a['contributor_role'] == 'author':
+            result['authors'].append(a.given_name.text + ' ' + a.surname.text)
+    return result
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return int.from_bytes(sha.digest(), 'big')
+
+
+def map_file(path):
+    # A read-only mapping behaves like bytes for slicing, hashing and
+    # writing, but pages come from the OS cache instead of the heap
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+async def verify_library(root='files', store=None, sections=None):
+    # Checks every file listed in the manifests under root, recording the
+    # size, mtime and hash of any file that had none yet
+    report = {'checked': 0, 'changed': [], 'missing': []}
+    if sections is None:
+        sections = section_store('json', None)
+    for path in await sections.paths(root):
+        manifest = await sections.read(path, 'manifest')
+        if manifest is None:
+            continue
+        updated = False
+        for name, entry in manifest.get('files', {}).items():
+            file = ArticleFile(path, manifest=entry, store=store)
+            report['checked'] += 1
+            try:
+                current = await file.current_hash()
+            except FileNotFoundError:
+                report['missing'].append(str(file.path))
+                continue
+            if current != file.fhash:
+                report['changed'].append(str(file.path))
+                continue
+            new_entry = {**entry, **file.to_manifest()}
+            if new_entry != entry:
+                manifest['files'][name] = new_entry
+                updated = True
+        if updated:
+            await sections.write(path, 'manifest', manifest)
+    return report
+
+
 class ArticleFile:
 
     DATABASE = 'files/pyread.db'
 
     def __init__(self, path=None, data=None, manifest=None, verify=False,
-                 infer_type=True):
+                 infer_type=True, store=None):
         self.data = data
         self.fhash = None
+        # Manifests used to store hash(self), the digest cut down by
+        # Python's hash(); such a value is only compared in that form
+        self.legacy_hash = False
+        self.size = None
+        self.mtime = None
+        self.blob = None
+        self.store = store
         self.name = None
         self.source = []
         self.ftype = FileType.UNKNOWN
@@ -115,16 +194,22 @@ class ArticleFile:
                 if inferred_type is not None:
                     self.ftype = inferred_type
 
-    def __hash__(self):
+    def digest(self):
         if self.fhash is None:
-            if self.data is None:
-                return 0
-            self.fhash = int.from_bytes(hashlib.sha256(self.data).digest(),
-                                        'big')
+            if self.data is not None:
+                self.fhash = int.from_bytes(
+                    hashlib.sha256(self.data).digest(), 'big')
+            elif self.blob is not None:
+                self.fhash = int(self.blob, 16)
         return self.fhash
 
+    def __hash__(self):
+        return hash(self.digest() or 0)
+
     def __eq__(self, other):
-        return hash(self) == hash(other)
+        if self.legacy_hash or other.legacy_hash:
+            return hash(self) == hash(other)
+        return self.digest() == other.digest()
 
     def __str__(self):
         return f'{self.name}: Modified {self.date}'
@@ -132,56 +217,141 @@ class ArticleFile:
     def __repr__(self):
         str(self)
 
+    @property
+    def location(self):
+        if self.blob is not None and self.store is not None:
+            return self.store.path(self.blob)
+        return self.path
+
+    def use_blob(self, blob, name, ftype, size=None):
+        self.reset()
+        self.blob = blob
+        self.size = size
+        self.name = name
+        self.path = self.dir.joinpath(name)
+        self.ftype = FileType(ftype)
+
     async def get_data(self):
+        # Not kept on the object, so the article cache holds no file bodies
         if self.data is not None:
             return self.data
-        if self.path is None:
+        if self.location is None:
             raise FileNotFoundError
-        async with aiofiles.open(str(self.path), 'rb') as f:
-            self.data = await f.read()
-        return self.data
+        return await asyncio.to_thread(map_file, self.location)
 
     def reset(self):
         self.data = None
         self.fhash = None
+        self.legacy_hash = False
+
+    async def current_hash(self):
+        # The stored hash is trusted for as long as the file's size and
+        # mtime match what was recorded with it; otherwise the file is
+        # rehashed in chunks on a worker thread.
+        if self.data is not None:
+            return int.from_bytes(hashlib.sha256(self.data).digest(), 'big')
+        if self.location is None:
+            raise FileNotFoundError
+        stat = await asyncio.to_thread(self.location.stat)
+        if (self.fhash is not None and not self.legacy_hash and
+                stat.st_size == self.size and stat.st_mtime_ns == self.mtime):
+            return self.fhash
+        fhash = await asyncio.to_thread(hash_file, self.location)
+        if self.legacy_hash and hash(fhash) == self.fhash:
+            # Upgraded to the full digest the next time it is written
+            self.fhash = None
+            self.legacy_hash = False
+        if self.fhash is None or fhash == self.fhash:
+            self.fhash = fhash
+            self.size = stat.st_size
+            self.mtime = stat.st_mtime_ns
+        return fhash
 
     async def changed(self):
-        new_file = ArticleFile()
-        new_file.data = await self.get_data()
-        return new_file != self
+        # current_hash() adopts the file's hash when it matches the stored
+        # one, so anything left different afterwards is a real change
+        if self.fhash is None:
+            return False
+        return await self.current_hash() != self.fhash
+
+    async def verify(self):
+        if await self.changed():
+            raise FileChangedError(self.name)
+
+    def _record_stat(self):
+        try:
+            stat = self.location.stat()
+        except (AttributeError, OSError):
+            return
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime_ns
 
     async def write(self, data=None):
         if data is None:
             data = self.data
+        if self.store is not None:
+            if data is not None:
+                self.blob = await self.store.put(data, sources=self.source,
+                                                 name=self.name,
+                                                 ftype=self.ftype.value)
+            elif self.blob is not None:
+                await self.store.retain(self.blob, self.size)
+                for source in self.source:
+                    await self.store.remember(source, self.blob, self.name,
+                                              self.ftype.value)
+            else:
+                raise FileNotFoundError
+            self.date = datetime.now()
+            self.reset()
+            self._record_stat()
+            print(f'Saved {self.name} as {self.location}')
+            return
         if self.path is None:
             raise FileNotFoundError
         async with aiofiles.open(str(self.path), 'wb') as f:
             await f.write(data)
         self.date = datetime.now()
         self.reset()
-        self.data = data
+        self.fhash = int.from_bytes(hashlib.sha256(data).digest(), 'big')
+        self._record_stat()
         print(f'Saved {self.path}')
 
     def from_manifest(self, entry):
         self.name = entry.get('name')
         self.source = entry.get('source')
+        self.blob = entry.get('blob')
         self.date = datetime.fromisoformat(entry.get('date'))
         ftype = entry.get('ftype')
         if ftype is None:
             ftype = FileType.UNKNOWN.value
         self.ftype = FileType(ftype)
+        self._load_hash(entry.get('hash'))
+        self.size = entry.get('size')
+        self.mtime = entry.get('mtime')
+
+    def _load_hash(self, stored):
+        # Full digests are stored as hex; older manifests have the int
+        # from hash(self), or 0 for files that were never loaded
+        self.legacy_hash = isinstance(stored, int) and stored != 0
+        if isinstance(stored, str):
+            self.fhash = int(stored, 16)
+        else:
+            self.fhash = stored or None
 
     async def verify_from_manifest(self, entry):
         self.name = entry['name']
+        self.path = self.dir.joinpath(self.name)
         self.source = entry['source']
+        self.blob = entry.get('blob')
         self.date = datetime.fromisoformat(entry['date'])
         ftype = entry.get('ftype')
         if ftype is None:
             ftype = FileType.UNKNOWN.value
         self.ftype = FileType(ftype)
-        await self.get_data()
-        if 'hash' in entry and hash(self) != entry['hash']:
-            raise FileChangedError
+        self._load_hash(entry.get('hash'))
+        self.size = entry.get('size')
+        self.mtime = entry.get('mtime')
+        await self.verify()
 
     def to_manifest(self, update_hash=False):
         entry = {}
@@ -189,26 +359,45 @@ class ArticleFile:
         entry['source'] = self.source
         entry['date'] = self.date.isoformat()
         entry['ftype'] = self.ftype.value
-        entry['hash'] = hash(self)
+        fhash = self.digest()
+        if fhash is None or self.legacy_hash:
+            entry['hash'] = fhash
+        else:
+            entry['hash'] = f'{fhash:064x}'
+        if self.size is not None:
+            entry['size'] = self.size
+            entry['mtime'] = self.mtime
+        if self.blob is not None:
+            entry['blob'] = self.blob
         return entry
 
     async def merge(self, other, verify=False):
         if verify:
-            if other.data is None:
-                await other.get_data()
-            if self.data is None:
-                await self.get_data()
-            if other != self:
+            if await other.current_hash() != await self.current_hash():
                 raise FileChangedError
         self.source = list(set([*self.source, *other.source]))
 
-    async def fetch(self, session, cookies=None, headers=None, source=0):
+    async def fetch(self, session, cookies=None, headers=None, source=0,
+                    downloader=None):
         self.reset()
-        async with session.get(self.source[source], headers=headers,
-                               cookies=cookies, ssl=sslcontext) as response:
-            self.data = await response.read()
-            content_disp = response.headers.get('Content-Disposition')
-            content_type = response.headers.get('Content-Type')
+        if downloader is not None and self.store is not None:
+            # Streamed to disk and moved straight into the blob store
+            download = await downloader.fetch(self.source[source],
+                                              cookies=cookies,
+                                              headers=headers)
+            self.blob = await self.store.adopt(download.path, download.blob,
+                                               download.size)
+            self.size = download.size
+            response_headers = download.headers
+        else:
+            self.blob = None
+            async with session.get(self.source[source], headers=headers,
+                                   cookies=cookies,
+                                   ssl=sslcontext) as response:
+                self.data = await response.read()
+                response_headers = response.headers
+        content_disp = response_headers.get('Content-Disposition')
+        content_type = response_headers.get('Content-Type')
         if content_disp is not None:
             fname = content_disp.find('filename=')
             if fname != -1:
@@ -235,32 +424,98 @@ class Article:
                'Mozilla/5.0 (Windows NT 6.1; Win64; x64; rv:77.0) '
                'Gecko/20100101 Firefox/77.0'}
 
-    DB_LOCATION = 'files/pyread.db'
+    DB_LOCATION = MetaDB.DB_LOCATION
+
+    DB_COLS = MetaDB.COLS
+
+    MAX_RETRIES = 5
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    MAX_CONCURRENT_REFS = 10
+
+    # verify_integrity() answers from memory until the article is changed
+    # through this object, or until one of these sections is seen to have
+    # changed; they are checked at most every INTEGRITY_RECHECK s
+    INTEGRITY_SECTIONS = ['content', 'references', 'figures']
+    INTEGRITY_RECHECK = 2
 
-    DB_COLS = {'doi': 'varchar(255)',
-               'pmid': 'int',
-               'title': 'text',
-               'authors': 'text',
-               'journal': 'varchar(255)',
-               'date': 'char(19)',
-               'local': 'char'}
+    # figures and manifest changes from add_file are batched and written
+    # this many seconds after the last one
+    FLUSH_DELAY = 0.5
 
-    def __init__(self, session, cookies, headers):
+    # Where manifest, content, references and figures are kept: 'json' for
+    # one file each in the article's directory, 'sqlite' for rows in the
+    # metadata database (see aio_sections)
+    SECTION_STORE = os.environ.get('PYREAD_ARTICLE_STORE', 'json')
+
+    NCBI_API_KEY = os.environ.get('NCBI_API_KEY')
+    NCBI_EMAIL = os.environ.get('NCBI_EMAIL')
+    CROSSREF_MAILTO = os.environ.get('CROSSREF_MAILTO')
+    CROSSREF_URL = os.environ.get('CROSSREF_URL')
+
+    _metadata_calls = SingleFlight()
+    limiter = HostLimiter({'eutils.ncbi.nlm.nih.gov': (10, 10)}
+                          if NCBI_API_KEY is not None else None)
+
+    def __init__(self, session, cookies, headers, db=None, parser=None,
+                 store=None, sections=None, download_session=None):
         self._ainit_done = False
-        self._ainit_start = False
+        self._ainit_task = None
+        self._integrity = None
+        self._integrity_signature = None
+        self._integrity_checked = 0
+        self._integrity_version = 0
+        self._figures = None
+        self._figures_lock = asyncio.Lock()
+        self._payloads = {}
+        self._figures_dirty = False
+        self._manifest_dirty = False
+        self._flush_task = None
         self.session = session
+        # Files are fetched through their own pool when one is given
+        if download_session is None:
+            download_session = session
+        self.download_session = download_session
         self.cookies = cookies
         self.headers = headers
+        if db is None:
+            db = MetaDB.shared(self.DB_LOCATION)
+        self.db = db
+        if parser is None:
+            parser = ParsePool.shared()
+        self.parser = parser
+        if store is None:
+            store = BlobStore(db)
+        self.store = store
+        if sections is None:
+            sections = section_store(self.SECTION_STORE, db)
+        self.sections = sections
+        self.downloader = Downloader(download_session,
+                                     store.root.joinpath('partial'),
+                                     ssl=sslcontext)
+        self.eutils = EUtils(self._get, api_key=self.NCBI_API_KEY,
+                             email=self.NCBI_EMAIL, parse=parser.run)
+        self.crossref = Crossref(self._get_crossref,
+                                 mailto=self.CROSSREF_MAILTO,
+                                 base_url=self.CROSSREF_URL,
+                                 parse=parser.run)
 
     async def a_init(self, doi=None, pmid=None, title=None):
         if self._ainit_done:
             await self.check_local()
             self.entry['local'] = self.manifest['local']
             return self.entry
-        if self._ainit_start:
-            await asyncio.sleep(1)
-            return await self.a_init(doi, pmid, title)
-        self._ainit_start = True
+        if self._ainit_task is None:
+            self._ainit_task = asyncio.ensure_future(
+                self._a_init(doi, pmid, title))
+        try:
+            return await asyncio.shield(self._ainit_task)
+        except Exception:
+            # Let the next caller retry instead of awaiting a failed init
+            if self._ainit_task is not None and self._ainit_task.done():
+                self._ainit_task = None
+            raise
+
+    async def _a_init(self, doi=None, pmid=None, title=None):
         entry = await self.fetch_metadata(doi, pmid, title)
         if entry['doi'] is not None:
             self.path = Path('files', doi)
@@ -270,17 +525,14 @@ class Article:
             raise ArticleError('Could not identify article')
         if not self.path.exists():
             self.path.mkdir(parents=True)
-        manifest_path = self.path.joinpath('manifest.json')
-        if manifest_path.exists():
-            async with aiofiles.open(str(manifest_path),
-                                     'r', encoding='utf-8') as m:
-                self.manifest = json.loads(await m.read())
-        else:
+        self.manifest = await self.sections.read(self.path, 'manifest')
+        if self.manifest is None:
             self.manifest = {}
         self.files = {}
         if 'files' in self.manifest:
             for k, v in self.manifest['files'].items():
-                self.files[k] = ArticleFile(self.path, manifest=v)
+                self.files[k] = ArticleFile(self.path, manifest=v,
+                                            store=self.store)
         else:
             self.manifest['files'] = {}
         await asyncio.gather(self.check_local(), self.update_manifest())
@@ -289,193 +541,93 @@ class Article:
         self._ainit_done = True
         return entry
 
+    async def _get(self, url, **kwargs):
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                async with self.limiter.request(url):
+                    async with self.session.get(url, ssl=sslcontext,
+                                                **kwargs) as response:
+                        if response.status == 200:
+                            return await response.read()
+                        status = response.status
+                        retry_after = response.headers.get('Retry-After')
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = e
+            print(f'{url}: {status}')
+            if isinstance(status, int) and status not in self.RETRY_STATUSES:
+                raise RequestError(f'{url}: {status}')
+            if attempt >= self.MAX_RETRIES:
+                raise RequestError(f'{url}: gave up after {attempt} retries')
+            delay = backoff(attempt)
+            try:
+                delay = max(delay, float(retry_after))
+            except (TypeError, ValueError):
+                pass
+            await asyncio.sleep(delay)
+            attempt += 1
+
     async def _fetch_from_pubmed(self, doi=None, pmid=None, title=None):
         result = {'doi': None, 'pmid': None, 'title': None, 'authors': None,
                   'journal': None, 'date': None}
-        if pmid is None:
-            url = URL('https://pubmed.ncbi.nlm.nih.gov/')
-            if doi is not None:
-                query = doi
+        try:
+            if pmid is not None:
+                found = (await self.eutils.fetch([pmid])).get(str(pmid))
+            elif doi is not None:
+                found = (await self.eutils.fetch_dois([doi])).get(doi.lower())
             elif title is not None:
-                query = title
-            else:
-                return result
-            encoded_query = 'term=' + urllib.parse.quote(f'"{query}"')
-            url._val = urllib.parse.SplitResult(url._val.scheme,
-                                                url._val.netloc,
-                                                url._val.path,
-                                                encoded_query,
-                                                url._val.fragment)
-        else:
-            url = URL('https://pubmed.ncbi.nlm.nih.gov/' + pmid)
-        retry = True
-        while retry:
-            async with self.session.get(url, ssl=sslcontext) as response:
-                if response.status == 200:
-                    retry = False
-                    soup = BeautifulSoup(await response.read(), 'lxml')
-                else:
-                    print(response.status)
-        d_soup = soup.find('span', {'class': 'doi'})
-        if d_soup is None:
-            if title is None:
-                return result
-            # This means there was more than one search result,
-            # so we compare the titles of all of the search results
-            # to our title and pick the closest one that is more
-            # than 90% similar
-            d_soup = soup.find_all('a', {'class': 'labs-docsum-title'})
-            max_score = 0
-            max_link = ''
-            for d in d_soup:
-                try:
+                # Compare the titles of all of the search results to our
+                # title and pick the closest one that is more than 90%
+                # similar
+                pmids = await self.eutils.search(f'"{title}"')
+                found = None
+                max_score = 0
+                for candidate in (await self.eutils.fetch(pmids)).values():
+                    if candidate['title'] is None:
+                        continue
                     score = SequenceMatcher(None, title,
-                                            d.text.strip()).ratio()
-                except AttributeError:
-                    return result
-                if score > max_score:
-                    max_score = score
-                    max_link = d['href']
-            if max_score > 0.9:
-                async with self.session.get('https://pubmed.ncbi.nlm.nih.gov' +
-                                            max_link,
-                                            ssl=sslcontext) as response:
-                    soup = BeautifulSoup(await response.read(),
-                                         'lxml')
-                d_soup = soup.find('span', {'class': 'doi'})
+                                            candidate['title']).ratio()
+                    if score > max_score:
+                        max_score = score
+                        found = candidate
+                if max_score <= 0.9:
+                    found = None
             else:
-                return result
-        try:
-            result['doi'] = d_soup.find('a').text.strip()
-        except AttributeError:
+                found = None
+        except RequestError:
+            found = None
+        if found is None:
             return result
-        if doi is not None:
-            assert doi.lower() == result['doi'].lower()
-        result['pmid'] = soup.find('strong',
-                                   {'class': 'current-id'}).text.strip()
-        if pmid is not None:
-            assert pmid == result['pmid']
-        cite = soup.find('span', {'class': 'cit'}).text
-        date = cite[:cite.find(';')]
-        result['date'] = self._parse_date(date).isoformat()
-        a_list = soup.find('div', {'class': 'authors-list'})
-        if a_list is not None:
-            authors = a_list.find_all('a', {'class': 'full-name'})
-        else:
-            authors = []
-        result['authors'] = []
-        for a in authors:
-            result['authors'].append(a.text.strip())
-        result['title'] = soup.find('h1',
-                                    {'class': 'heading-title'}).text.strip()
-        result['journal'] = soup.find(
-            'button', {'id': 'full-view-journal-trigger'})['title'].strip()
-        return result
+        return {**result, **found}
+
+    async def _get_crossref(self, url, **kwargs):
+        return await self._get(url, headers=self.HEADERS, **kwargs)
 
     async def _fetch_from_crossref(self, doi):
         result = {'title': None, 'authors': None, 'journal': None,
                   'date': None}
-        headers = {**self.HEADERS,
-                   'Accept': 'application/vnd.crossref.unixsd+xml'}
-        url = 'http://dx.doi.org/' + doi
-        async with self.session.get(url, headers=headers,
-                                    cookies=self.cookies,
-                                    ssl=sslcontext) as response:
-            s = BeautifulSoup(await response.read(), 'xml')
-        try:
-            result['title'] = self._sanitize(s.title.text)
-            result['journal'] = s.journal_metadata.full_title.text
-            for i in s.find_all('crm-item'):
-                if i['name'] == 'created':
-                    date = datetime.fromisoformat(i.text[:-1])
-                    result['date'] = date.isoformat()
-            result['authors'] = []
-            for a in s.find_all('person_name'):
-                if a['contributor_role'] == 'author':
-                    name = a.given_name.text + ' ' + a.surname.text
-                    result['authors'].append(name)
-        except AttributeError:
-            pass
-        return result
-
-    def _parse_date(self, date):
-        months = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG',
-                  'SEP', 'OCT', 'NOV', 'DEC']
-        long_months = ['JANUARY', 'FEBRUARY', 'MARCH', 'APRIL', 'MAY', 'JUNE',
-                       'JULY', 'AUGUST', 'SEPTEMBER', 'OCTOBER', 'NOVEMBER',
-                       'DECEMBER']
-        try:
-            return datetime.strptime(date, '%Y %b %d')
-        except ValueError:
-            pass
-        try:
-            return datetime.strptime(date, '%Y %B %d')
-        except ValueError:
-            pass
-        try:
-            return datetime.strptime(date, '%b %Y')
-        except ValueError:
-            pass
-        try:
-            return datetime.strptime(date, '%B %Y')
-        except ValueError:
-            pass
         try:
-            return datetime.strptime(date, '%Y %b')
-        except ValueError:
-            pass
-        try:
-            return datetime.strptime(date, '%Y %B')
-        except ValueError:
-            pass
-        try:
-            return datetime.strptime(date, '%Y')
-        except ValueError:
-            pass
-        datestring = ''
-        pstring = ''
-        match = re.search(r'(\d+)?(.*)?(\d\d\d\d)', date)
-        if match[1] is not None and match[1] != '':
-            datestring += match[1]
-            pstring += '%d'
-        if match[2] is not None and match[2] != '':
-            first_match_pos = -1
-            month = ''
-            for m in months:
-                match_pos = datestring.find(m)
-                if first_match_pos == -1 or match_pos < first_match_pos:
-                    month = m
-                    first_match_pos = match_pos
-            if month != '':
-                datestring += month
-                pstring += '%b'
-            else:
-                first_match_pos = -1
-                month = ''
-                for m in long_months:
-                    match_pos = datestring.find(m)
-                    if first_match_pos == -1 or match_pos < first_match_pos:
-                        month = m
-                        first_match_pos = match_pos
-                    if month != '':
-                        datestring += month
-                        pstring += '%B'
-        if match[3] is not None and match[3] != '':
-            datestring += match[3]
-            pstring += '%Y'
-        return datetime.strptime(datestring, pstring)
-
-    def _sanitize(self, s):
-        s = re.sub(r'\\n', '', s)
-        return ' '.join(s.split())
+            found = await self.crossref.fetch([doi])
+        except RequestError:
+            return result
+        return {**result, **found.get(doi.lower(), {})}
 
     async def fetch_metadata(self, doi=None, pmid=None, title=None):
-        async with aiosqlite.connect(self.DB_LOCATION) as db_conn:
-            async with db_conn.cursor() as db:
-                await db.execute('CREATE TABLE IF NOT EXISTS ref_database (' +
-                                 ','.join([' '.join([k, v])
-                                           for k, v in self.DB_COLS.items()]) +
-                                 ')')
+        # Keyed on the strongest identifier only: different articles can
+        # share a title (errata, replies), or one of pmid and doi
+        if doi is not None:
+            key = ('doi', doi.lower())
+        elif pmid is not None:
+            key = ('pmid', str(pmid))
+        else:
+            key = ('title', title)
+        entry = await self._metadata_calls.do(
+            key, lambda: self._fetch_metadata(doi, pmid, title))
+        # Every caller gets its own copy of the shared result
+        return {**entry}
+
+    async def _fetch_metadata(self, doi=None, pmid=None, title=None):
         entry, key = await self._from_db({'doi': doi, 'pmid': pmid})
         if entry is not None and entry != {}:
             return entry
@@ -486,19 +638,33 @@ class Article:
             entry['pmid'] = pmid
         if entry.get('title') is None:
             entry['title'] = title
-        pubmed_success = False
-        for v in entry.values():
-            if v is None:
-                pubmed_success = False
-        if not pubmed_success and entry['doi'] is not None:
-            result = await self._fetch_from_crossref(entry['doi'])
+        await self._fill_from_crossref([entry])
+        await self._add_to_db(entry)
+        return entry
+
+    async def _fill_from_crossref(self, entries):
+        missing = []
+        for entry in entries:
+            pubmed_success = True
+            for v in entry.values():
+                if v is None or v == []:
+                    pubmed_success = False
+            if not pubmed_success and entry['doi'] is not None:
+                missing.append(entry)
+        if len(missing) == 0:
+            return
+        try:
+            found = await self.crossref.fetch([e['doi'] for e in missing])
+        except RequestError:
+            return
+        for entry in missing:
+            result = found.get(entry['doi'].lower(), {})
             for k, v in entry.items():
                 if v is None or v == []:
                     entry[k] = result.get(k)
-        await self._add_to_db(entry)
-        return entry
 
     def add_content(self, content, overwrite=True):
+        self._invalidate_integrity()
         if not hasattr(self, 'content'):
             self.content = []
         for c in content:
@@ -512,15 +678,82 @@ class Article:
             if not exists:
                 self.content.append(c)
 
-    async def add_reference(self, ref, num):
+    async def _resolve_references(self, refs):
+        # Look every reference up in the database and then in batched
+        # PubMed requests, leaving only the stragglers to fetch_metadata
+        dois = {}
+        pmids = {}
+        for num, ref in enumerate(refs):
+            if ref is None:
+                continue
+            if ref.get('doi') is not None:
+                dois[num] = ref['doi']
+            elif ref.get('pmid') is not None:
+                pmids[num] = str(ref['pmid'])
+        by_doi = {k.lower(): v for k, v in
+                  (await self.db.get_many(dois.values())).items()}
+        by_pmid = await self.db.get_many(pmids.values(), key='pmid')
+        try:
+            fetched = [*(await self.eutils.fetch_dois(
+                            [d for d in dois.values()
+                             if d.lower() not in by_doi])).values(),
+                       *(await self.eutils.fetch(
+                            [p for p in pmids.values()
+                             if p not in by_pmid])).values()]
+        except RequestError:
+            fetched = []
+        # DOIs PubMed does not know go to Crossref in the same batch as
+        # the gaps in what it returned
+        returned = {e['doi'].lower() for e in fetched
+                    if e['doi'] is not None}
+        unknown = [{'doi': d, 'pmid': None, 'title': None, 'authors': None,
+                    'journal': None, 'date': None}
+                   for d in {d.lower(): d for d in dois.values()}.values()
+                   if d.lower() not in by_doi and d.lower() not in returned]
+        await self._fill_from_crossref(fetched + unknown)
+        fetched += [e for e in unknown if e['title'] is not None]
+        for entry in fetched:
+            await self._add_to_db(entry)
+            if entry['doi'] is not None:
+                by_doi[entry['doi'].lower()] = entry
+            if entry['pmid'] is not None:
+                by_pmid[entry['pmid']] = entry
+        resolved = {}
+        for num, doi in dois.items():
+            if doi.lower() in by_doi:
+                resolved[num] = by_doi[doi.lower()]
+        for num, pmid in pmids.items():
+            if pmid in by_pmid:
+                resolved[num] = by_pmid[pmid]
+        return resolved
+
+    async def add_references(self, refs, progress=None):
+        resolved = await self._resolve_references(refs)
+        semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_REFS)
+        done = 0
+
+        async def resolve(ref, num):
+            nonlocal done
+            async with semaphore:
+                await self.add_reference(ref, num, entry=resolved.get(num))
+            done += 1
+            if progress is not None:
+                progress(done, len(refs))
+
+        await asyncio.gather(*[resolve(ref, num)
+                               for num, ref in enumerate(refs)])
+
+    async def add_reference(self, ref, num, entry=None):
         if ref is None:
             entry = None
-        else:
-            entry = await Article(self.session, self.cookies,
-                                  self.headers).fetch_metadata(
-                                                   doi=ref.get('doi'),
-                                                   pmid=ref.get('pmid'),
-                                                   title=ref.get('title'))
+        elif entry is None:
+            article = Article(self.session, self.cookies, self.headers,
+                              db=self.db, parser=self.parser,
+                              store=self.store, sections=self.sections,
+                              download_session=self.download_session)
+            entry = await article.fetch_metadata(doi=ref.get('doi'),
+                                                 pmid=ref.get('pmid'),
+                                                 title=ref.get('title'))
         print(f"REF {num}: {json.dumps(entry).encode('utf-8')}")
         if not hasattr(self, 'references'):
             self.references = []
@@ -529,76 +762,88 @@ class Article:
                 self.references.append(None)
         self.references[num] = entry
 
-    def update_metadata(self, xml):
-        s = BeautifulSoup(xml, 'xml')
-        title = s.title.text
-        journal = s.journal_metadata.full_title.text
-        for i in s.find_all('crm-item'):
-            if i['name'] == 'created':
-                date = datetime.fromisoformat(i.text[:-1])
-        authors = []
-        for a in s.find_all('person_name'):
-            if a['contributor_role'] == 'author':
-                name = a.given_name.text + ' ' + a.surname.text
-                authors.append(name)
-        self.manifest['title'] = self._sanitize(title)
-        self.manifest['journal'] = journal
-        self.manifest['date'] = date.isoformat()
-        self.manifest['authors'] = authors
+    async def update_metadata(self, xml):
+        result = await self.parser.run(parse_unixsd, xml)
+        self.manifest['title'] = result['title']
+        self.manifest['journal'] = result['journal']
+        self.manifest['date'] = result['date']
+        self.manifest['authors'] = result['authors']
         self.manifest['metadate'] = datetime.now().isoformat()
 
     async def update_manifest(self):
         if not self.path.exists():
             self.path.mkdir(parents=True)
-        manifest_path = self.path.joinpath('manifest.json')
-        async with aiofiles.open(str(manifest_path), 'w',
-                                 encoding='utf-8') as m:
-            await m.write(json.dumps(self.manifest))
+        await self._write_section('manifest', self.manifest)
+
+    async def _write_section(self, section, obj):
+        await self.sections.write(self.path, section, obj)
+        # Whatever payload() made from the old version is stale, even if
+        # the store's signature has not visibly changed
+        self._payloads.pop(section, None)
 
     async def save(self):
-        async with aiofiles.open(str(self.path.joinpath('content.json')),
-                                 'w') as f:
-            await f.write(json.dumps(self.content))
+        self._invalidate_integrity()
+        await self._write_section('content', self.content)
         if hasattr(self, 'references'):
-            async with aiofiles.open(str(self.path.joinpath(
-                                             'references.json')), 'w') as f:
-                await f.write(json.dumps(self.references))
+            await self._write_section('references', self.references)
         await self.check_local()
 
-    async def load(self):
-        if self.path.joinpath('content.json').exists():
-            async with aiofiles.open(str(self.path.joinpath('content.json')),
-                                     'r') as f:
-                self.content = json.loads(await f.read())
-        if self.path.joinpath('references.json').exists():
-            async with aiofiles.open(str(self.path.joinpath(
-                                              'references.json')), 'r') as f:
-                self.references = json.loads(await f.read())
+    async def load(self, *sections):
+        # Only the sections asked for are read, content and references
+        # when none are given
+        if len(sections) == 0:
+            sections = ('content', 'references')
+        for section in sections:
+            obj = await self.sections.read(self.path, section)
+            if obj is not None:
+                setattr(self, section, obj)
+
+    async def fetch_file(self, source, date=None, cookies=None):
+        if date is None:
+            date = datetime.now().isoformat()
+        if cookies is None:
+            cookies = self.cookies
+        new_file = ArticleFile(path=self.path,
+                               manifest={'name': None,
+                                         'source': [source],
+                                         'date': date},
+                               store=self.store)
+        # Files already downloaded from this source for any article are
+        # reused from the blob store
+        known = await self.store.lookup(source)
+        if known is not None:
+            new_file.use_blob(*known)
+        else:
+            await new_file.fetch(self.download_session, cookies,
+                                 self.headers,
+                                 downloader=self.downloader)
+        return new_file
 
     async def add_file(self, source, name=None, data=None, identity=None,
                        overwrite=False, date=None, content_type=None,
                        content_length=None, number=0, title=None, caption='',
-                       low_res=False):
+                       low_res=False, cookies=None):
         if self.files is None:
             self.files = {}
         if date is None:
             date = datetime.now().isoformat()
+        self._invalidate_integrity()
         print(f"Adding file to {self.path}")
-        new_file = ArticleFile(data=data, path=self.path,
-                               manifest={'name': name,
-                                         'source': [source],
-                                         'date': date,
-                                         'content_type': content_type,
-                                         'content_length': content_length})
         if data is None:
-            await new_file.fetch(self.session, self.cookies, self.headers)
-            data = new_file.data
+            new_file = await self.fetch_file(source, date=date,
+                                             cookies=cookies)
             name = new_file.name
-        if content_length is None:
+        else:
+            new_file = ArticleFile(data=data, path=self.path,
+                                   manifest={'name': name,
+                                             'source': [source],
+                                             'date': date,
+                                             'content_type': content_type,
+                                             'content_length':
+                                                 content_length},
+                                   store=self.store)
+        if content_length is None and data is not None:
             content_length = len(data)
-        if name in self.files and not overwrite:
-            if new_file != self.files[name]:
-                raise FileExistsError
         entry = {'name': name,
                  'title': title,
                  'caption': caption}
@@ -658,18 +903,61 @@ class Article:
                            ArticleItem.SUPPLEMENTARY_VIDEO:
                                do_what(do_order, 'supp_vids'),
                            ArticleItem.OTHER: do_what(do_files, 'other')}
-        if Path(self.path, 'figures.json').exists():
-            with Path(self.path, 'figures.json').open(mode='r') as f:
-                fig_leg = json.loads(f.read())
-        else:
-            fig_leg = {}
-        identity_lookup[identity]()
-        self.files[name] = new_file
-        self.manifest['files'][name] = new_file.to_manifest()
-        with Path(self.path, 'figures.json').open(mode='w') as f:
-            f.write(json.dumps(fig_leg))
-        await asyncio.gather(self.check_local(), new_file.write(),
-                             self.update_manifest())
+        async with self._figures_lock:
+            # Checked under the lock, since another add_file for the same
+            # name may have got here while this one was downloading
+            if name in self.files and not overwrite:
+                if new_file != self.files[name]:
+                    raise FileExistsError
+            fig_leg = await self._load_figures()
+            snapshot = json.dumps(fig_leg)
+            identity_lookup[identity]()
+            old_file = self.files.get(name)
+            try:
+                await new_file.write()
+            except BaseException:
+                self._figures = json.loads(snapshot)
+                raise
+            if old_file is not None and old_file.blob is not None:
+                await self.store.release(old_file.blob)
+            self.files[name] = new_file
+            self.manifest['files'][name] = new_file.to_manifest()
+            self._figures_dirty = True
+            self._manifest_dirty = True
+        self._schedule_flush()
+        self._invalidate_integrity()
+        await self.check_local()
+
+    async def _load_figures(self):
+        if self._figures is None:
+            figures = await self.sections.read(self.path, 'figures')
+            if figures is None:
+                figures = {}
+            # Someone else may have loaded (and changed) it meanwhile
+            if self._figures is None:
+                self._figures = figures
+        return self._figures
+
+    def _schedule_flush(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.FLUSH_DELAY)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        async with self._figures_lock:
+            if self._figures_dirty:
+                self._figures_dirty = False
+                await self._write_section('figures', self._figures)
+            if self._manifest_dirty:
+                self._manifest_dirty = False
+                await self.update_manifest()
 
     def add_url(self, url):
         if self.url is None:
@@ -681,89 +969,24 @@ class Article:
         return self.manifest.get('metadate')
 
     async def _from_db(self, entry):
-        result = None
-        async with aiosqlite.connect(self.DB_LOCATION) as db_conn:
-            async with db_conn.cursor() as db:
-                if entry.get('doi') is not None:
-                    await db.execute('SELECT * FROM ref_database '
-                                     'WHERE doi=?;', (entry['doi'],))
-                    key = 'doi'
-                    result = await db.fetchone()
-                if result is None and entry.get('pmid') is not None:
-                    await db.execute('SELECT * FROM ref_database '
-                                     'WHERE pmid=?;', (entry['pmid'],))
-                    key = 'pmid'
-                    result = await db.fetchone()
-                if result is None:
-                    key = None
-            new_entry = {}
-            if result is not None:
-                for k, e in zip(self.DB_COLS.keys(), result):
-                    if k == 'pmid':
-                        if e is not None:
-                            e = str(e)
-                    elif k == 'local':
-                        e = e == 'T'
-                    elif k == 'authors':
-                        e = json.loads(e)
-                    new_entry[k] = e
-            return new_entry, key
+        return await self.db.get(entry)
 
     async def _add_to_db(self, entry):
-        new_entry = {**entry}
-        if entry.get('pmid') is not None:
-            new_entry['pmid'] = int(entry['pmid'])
-        if entry.get('local') is True:
-            new_entry['local'] = 'T'
-        else:
-            new_entry['local'] = 'F'
-        if entry.get('authors') is not None:
-            new_entry['authors'] = json.dumps(entry['authors'])
-        async with aiosqlite.connect(self.DB_LOCATION) as db_conn:
-            async with db_conn.cursor() as db:
-                await db.execute('INSERT INTO ref_database VALUES (' +
-                                 ','.join(["?"]*len(self.DB_COLS)) + ')',
-                                 tuple(new_entry.get(k) for k in
-                                       self.DB_COLS.keys()))
-            await db_conn.commit()
+        await self.db.upsert(entry)
 
     async def _update_db(self, entry, key='doi'):
-        new_entry = {**entry}
-        if entry.get('pmid') is not None:
-            new_entry['pmid'] = int(entry['pmid'])
-        if entry.get('local') is True:
-            new_entry['local'] = 'T'
-        else:
-            new_entry['local'] = 'F'
-        if entry.get('authors') is not None:
-            new_entry['authors'] = json.dumps(entry['authors'])
-        async with aiosqlite.connect(self.DB_LOCATION) as db_conn:
-            async with db_conn.cursor() as db:
-                await db.execute('UPDATE ref_database SET ' +
-                                 ','.join([k + ' = ?' for k in
-                                           self.DB_COLS.keys()]) +
-                                 f'WHERE {key}=?',
-                                 tuple(new_entry.get(k) for k
-                                       in self.DB_COLS.keys()) + (entry[key],))
+        await self.db.update(entry, key=key)
 
     async def update_meta_db(self, entry, overwrite=False):
-        result, key = await self._from_db(entry)
-        if not overwrite:
-            for k, v in result.items():
-                if entry.get(k) is not None:
-                    if k != 'local':
-                        assert(entry[k] == v)
-
-        if key is None:
-            await self._add_to_db(entry)
-        else:
-            await self._update_db(entry, key=key)
+        await self.db.upsert(entry, overwrite=overwrite)
 
     async def check_local(self):
         result = await self.verify_integrity()
         is_local = True
         for v in result.values():
             is_local = is_local and v
+        if self.manifest.get('local') == is_local:
+            return
         self.manifest['local'] = is_local
         await asyncio.gather(self.update_meta_db(
                                  {'title': self.manifest.get('title'),
@@ -772,12 +995,46 @@ class Article:
                                   'local': is_local}),
                              self.update_manifest())
 
+    def _file_exists(self, name):
+        file = (getattr(self, 'files', None) or {}).get(name)
+        if file is not None and file.location is not None:
+            return file.location.exists()
+        return Path(self.path, name).exists()
+
+    def _invalidate_integrity(self):
+        self._integrity = None
+        self._integrity_version += 1
+
+    async def _integrity_signature_now(self):
+        return await self.sections.signature(self.path,
+                                             self.INTEGRITY_SECTIONS)
+
     async def verify_integrity(self):
+        now = time.monotonic()
+        if self._integrity is not None:
+            if now - self._integrity_checked < self.INTEGRITY_RECHECK:
+                return {**self._integrity}
+            signature = await self._integrity_signature_now()
+            if signature == self._integrity_signature:
+                self._integrity_checked = now
+                return {**self._integrity}
+        # Taken before the files are read so that a write racing with
+        # _verify_integrity() is caught next time
+        signature = await self._integrity_signature_now()
+        version = self._integrity_version
+        result = await self._verify_integrity()
+        if version == self._integrity_version:
+            self._integrity = result
+            self._integrity_signature = signature
+            self._integrity_checked = now
+        return {**result}
+
+    async def _verify_integrity(self):
         result = {'abstract': False,
                   'content': False,
                   'figures': False,
                   'references': False}
-        await self.load()
+        await self.load('content')
         if hasattr(self, 'content'):
             for item in self.content:
                 if item['title'] == 'Abstract':
@@ -786,37 +1043,60 @@ class Article:
                     identity = 'content'
                 if (item['content'] is not None and len(item['content']) > 0):
                     result[identity] = True
-        if Path(self.path, 'figures.json').exists():
+        figures = await self._load_figures()
+        if (len(figures) > 0 or
+                await self.sections.exists(self.path, 'figures')):
             result['figures'] = True
-            async with aiofiles.open(str(Path(self.path, 'figures.json')),
-                                     'r') as f:
-                figures = json.loads(await f.read())
-                for k, v in figures.items():
-                    if isinstance(v, list):
-                        for f in v:
-                            for res in ['name', 'lr']:
-                                if res in f:
-                                    result['figures'] = (result['figures'] and
-                                                         Path(self.path,
-                                                              f[res]).exists())
-                    else:
-                        result['figures'] = (result['figures'] and
-                                             Path(self.path,
-                                                  v['name']).exists())
-        if Path(self.path, 'references.json').exists():
-            async with aiofiles.open(str(Path(self.path, 'references.json')),
-                                     'r') as f:
-                refs = json.loads(await f.read())
-                if len(refs) > 0:
-                    result['references'] = True
+            for k, v in figures.items():
+                if isinstance(v, list):
+                    for f in v:
+                        for res in ['name', 'lr']:
+                            if res in f:
+                                result['figures'] = (result['figures'] and
+                                                     self._file_exists(f[res]))
+                else:
+                    result['figures'] = (result['figures'] and
+                                         self._file_exists(v['name']))
+        refs = await self.sections.read(self.path, 'references')
+        if refs is not None and len(refs) > 0:
+            result['references'] = True
         return result
 
     async def file_info(self):
-        async with aiofiles.open(Path(self.path, 'figures.json'), 'r') as f:
-            return json.loads(await f.read())
+        figures = await self._load_figures()
+        if (len(figures) == 0 and
+                not await self.sections.exists(self.path, 'figures')):
+            raise FileNotFoundError
+        return figures
+
+    async def payload(self, section, encode):
+        # encode(obj) (something with a size, e.g. a CompressedBody) for
+        # the section as stored, reused for as long as the store reports
+        # the same version of it
+        signature = await self.sections.signature(self.path, [section])
+        cached = self._payloads.get(section)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        await self.load(section)
+        if signature == (None,) or not hasattr(self, section):
+            raise FileNotFoundError(section)
+        payload = encode(getattr(self, section))
+        self._payloads[section] = (signature, payload)
+        return payload
+
+    def resident_size(self):
+        size = sum(p.size for _, p in self._payloads.values())
+        for f in (getattr(self, 'files', None) or {}).values():
+            if f.data is not None:
+                size += len(f.data)
+        return size
+
+    def stored_file(self, name):
+        file = (getattr(self, 'files', None) or {}).get(name)
+        if (file is None or file.location is None or
+                not file.location.exists()):
+            raise FileNotFoundError(name)
+        return file
 
     async def get_file(self, name):
-        file = self.files[name]
-        if file.data is None:
-            return await file.get_data()
-        return file.data
+        return await self.stored_file(name).get_data()
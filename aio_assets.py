@@ -0,0 +1,180 @@
+from pathlib import Path
+import asyncio
+import gzip
+import hashlib
+import os
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+MIME_TYPES = {'.js': 'text/javascript',
+              '.css': 'text/css',
+              '.html': 'text/html',
+              '.json': 'application/json',
+              '.webmanifest': 'application/manifest+json',
+              '.svg': 'image/svg+xml',
+              '.png': 'image/png',
+              '.jpg': 'image/jpeg',
+              '.jpeg': 'image/jpeg',
+              '.gif': 'image/gif',
+              '.ico': 'image/x-icon',
+              '.pdf': 'application/pdf'}
+
+# Only these are worth compressing, images are compressed already
+COMPRESSIBLE = {'.js', '.css', '.html', '.json', '.webmanifest', '.svg'}
+
+
+def accepted_encodings(header):
+    encodings = set()
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        encodings.add(coding.strip().lower())
+    return encodings
+
+
+class CompressedBody:
+
+    # A response body and its Content-Encoding variants, each compressed
+    # the first time it is asked for
+
+    GZIP_LEVEL = 6
+    BROTLI_QUALITY = 5
+    MIN_SIZE = 256
+
+    def __init__(self, body, compressible=True):
+        self.tag = hashlib.sha256(body).hexdigest()[:16]
+        self.compressible = compressible and len(body) >= self.MIN_SIZE
+        # Content-Encoding -> body, the identity body under None; None
+        # for encodings that turned out not to save anything
+        self.variants = {None: body}
+
+    @property
+    def body(self):
+        return self.variants[None]
+
+    @property
+    def size(self):
+        return sum(len(v) for v in self.variants.values() if v is not None)
+
+    def encodings(self):
+        if not self.compressible:
+            return []
+        if brotli is None:
+            return ['gzip']
+        return ['br', 'gzip']
+
+    def encode(self, encoding):
+        if encoding not in self.variants:
+            if encoding == 'br':
+                body = brotli.compress(self.body,
+                                       quality=self.BROTLI_QUALITY)
+            else:
+                body = gzip.compress(self.body, self.GZIP_LEVEL, mtime=0)
+            if len(body) >= len(self.body):
+                body = None
+            self.variants[encoding] = body
+        return self.variants[encoding]
+
+    def variant(self, accept_encoding):
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in self.encodings():
+            if encoding in accepted:
+                body = self.encode(encoding)
+                if body is not None:
+                    return encoding, body
+        return None, self.body
+
+
+class Asset(CompressedBody):
+
+    # Compressed as hard as possible, and up front, since it only happens
+    # when the file changes
+
+    GZIP_LEVEL = 9
+    BROTLI_QUALITY = 11
+
+    def __init__(self, name, body, stat):
+        super().__init__(body, Path(name).suffix.lower() in COMPRESSIBLE)
+        self.name = name
+        self.content_type = MIME_TYPES.get(Path(name).suffix.lower())
+        self.stat = (stat.st_mtime_ns, stat.st_size)
+        self.checked = time.monotonic()
+        for encoding in self.encodings():
+            self.encode(encoding)
+
+
+class AssetCache:
+
+    # Everything under root is read and compressed once at startup.
+    # An asset is stat'ed again at most every RELOAD_INTERVAL s when it is
+    # asked for and reloaded if it changed, so edits show up without a
+    # restart.
+
+    ROOT = 'assets'
+    RELOAD_INTERVAL = 2
+
+    def __init__(self, root=None):
+        if root is None:
+            root = self.ROOT
+        self.root = Path(root).resolve()
+        self._assets = {}
+
+    def _path(self, name):
+        path = self.root.joinpath(name).resolve()
+        if self.root not in path.parents or not path.is_file():
+            raise FileNotFoundError(name)
+        return path
+
+    def _load(self, name):
+        path = self._path(name)
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            return Asset(name, f.read(), stat)
+
+    def _refresh(self, name):
+        asset = self._assets.get(name)
+        try:
+            stat = self._path(name).stat()
+        except FileNotFoundError:
+            self._assets.pop(name, None)
+            raise
+        if (asset is not None and
+                asset.stat == (stat.st_mtime_ns, stat.st_size)):
+            asset.checked = time.monotonic()
+            return asset
+        asset = self._load(name)
+        self._assets[name] = asset
+        return asset
+
+    async def load(self):
+        def load_all():
+            for path in self.root.rglob('*'):
+                if path.is_file():
+                    name = path.relative_to(self.root).as_posix()
+                    self._assets[name] = self._load(name)
+        await asyncio.to_thread(load_all)
+        return len(self._assets)
+
+    async def get(self, name):
+        asset = self._assets.get(name)
+        if (asset is None or
+                time.monotonic() - asset.checked >= self.RELOAD_INTERVAL):
+            asset = await asyncio.to_thread(self._refresh, name)
+        return asset
+
+    def tag(self, name):
+        asset = self._assets.get(name)
+        if asset is None:
+            return None
+        return asset.tag
@@ -0,0 +1,91 @@
+from pathlib import Path
+import hashlib
+import os
+import secrets
+import aiofiles
+
+
+class BlobStore:
+
+    # File contents are stored once under their SHA-256, manifests refer to
+    # them by hash and the blobs table counts how many entries do.
+
+    ROOT = 'files/blobs'
+
+    def __init__(self, db, root=None):
+        self.db = db
+        if root is None:
+            root = self.ROOT
+        self.root = Path(root)
+
+    def path(self, blob):
+        return self.root.joinpath(blob[:2], blob)
+
+    async def put(self, data, sources=(), name=None, ftype=None):
+        blob = hashlib.sha256(data).hexdigest()
+        path = self.path(blob)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f'{blob}.{secrets.token_hex(4)}.tmp')
+            async with aiofiles.open(str(tmp), 'wb') as f:
+                await f.write(data)
+            os.replace(tmp, path)
+        await self.retain(blob, len(data))
+        for source in sources:
+            await self.remember(source, blob, name, ftype)
+        return blob
+
+    async def adopt(self, path, blob, size=None):
+        # Moves a file already hashed as blob (e.g. a finished download on
+        # the same filesystem) into the store. Until an entry retains it,
+        # it has no references and is left for gc()
+        target = self.path(blob)
+        if target.exists():
+            os.remove(path)
+        else:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(path, target)
+        await self.db.execute('INSERT INTO blobs VALUES (?, ?, 0) '
+                              'ON CONFLICT(hash) DO NOTHING', (blob, size))
+        return blob
+
+    async def retain(self, blob, size=None):
+        await self.db.execute('INSERT INTO blobs VALUES (?, ?, 1) '
+                              'ON CONFLICT(hash) DO UPDATE SET '
+                              'refs = refs + 1, '
+                              'size = coalesce(excluded.size, size)',
+                              (blob, size))
+
+    async def release(self, blob):
+        await self.db.execute('UPDATE blobs SET refs = refs - 1 '
+                              'WHERE hash = ?', (blob,))
+
+    async def remember(self, source, blob, name, ftype):
+        await self.db.execute('INSERT INTO blob_sources VALUES (?, ?, ?, ?) '
+                              'ON CONFLICT(url) DO UPDATE SET '
+                              'hash = excluded.hash, name = excluded.name, '
+                              'ftype = excluded.ftype',
+                              (source, blob, name, ftype))
+
+    async def lookup(self, source):
+        rows = await self.db.fetchall('SELECT blob_sources.hash, name, ftype, '
+                                      'size FROM blob_sources JOIN blobs ON '
+                                      'blobs.hash = blob_sources.hash '
+                                      'WHERE url = ?', (source,))
+        if len(rows) == 0 or not self.path(rows[0][0]).exists():
+            return None
+        return rows[0]
+
+    async def gc(self):
+        rows = await self.db.fetchall('SELECT hash FROM blobs '
+                                      'WHERE refs <= 0')
+        for (blob,) in rows:
+            try:
+                self.path(blob).unlink()
+            except FileNotFoundError:
+                pass
+            await self.db.execute('DELETE FROM blob_sources WHERE hash = ?',
+                                  (blob,))
+            await self.db.execute('DELETE FROM blobs WHERE hash = ?', (blob,))
+        await self.db.flush()
+        return len(rows)
@@ -0,0 +1,85 @@
+from datetime import datetime
+import asyncio
+import json
+from aio_parsepool import ParsePool
+from aio_http import RequestError
+
+
+def parse_works(body):
+    results = {}
+    for item in json.loads(body)['message'].get('items', []):
+        result = {'doi': item.get('DOI'), 'title': None, 'authors': [],
+                  'journal': None, 'date': None}
+        if result['doi'] is None:
+            continue
+        if item.get('title'):
+            result['title'] = ' '.join(item['title'][0].split())
+        if item.get('container-title'):
+            result['journal'] = item['container-title'][0]
+        created = item.get('created', {}).get('date-time')
+        if created is not None:
+            result['date'] = datetime.fromisoformat(
+                created.rstrip('Z')).isoformat()
+        for a in item.get('author', []):
+            if 'family' in a:
+                name = a['family']
+                if 'given' in a:
+                    name = a['given'] + ' ' + name
+                result['authors'].append(name)
+            elif 'name' in a:
+                result['authors'].append(a['name'])
+        results[result['doi'].lower()] = result
+    return results
+
+
+class Crossref:
+
+    BASE_URL = 'https://api.crossref.org/'
+    FIELDS = ['DOI', 'title', 'container-title', 'author', 'created']
+
+    # DOIs per filter query and filter queries in flight at once
+    BATCH_SIZE = 40
+    CONCURRENCY = 4
+
+    def __init__(self, get, mailto=None, base_url=None, concurrency=None,
+                 parse=None):
+        # get(url, params=...) -> bytes, raising on failure
+        self.get = get
+        # parse(fn, body) -> fn(body), by default on the shared ParsePool
+        if parse is None:
+            parse = ParsePool.shared().run
+        self.parse = parse
+        self.mailto = mailto
+        if base_url is None:
+            base_url = self.BASE_URL
+        self.base_url = base_url
+        if concurrency is None:
+            concurrency = self.CONCURRENCY
+        self.concurrency = concurrency
+
+    def _params(self, dois):
+        params = {'filter': ','.join('doi:' + d for d in dois),
+                  'select': ','.join(self.FIELDS),
+                  'rows': str(len(dois))}
+        if self.mailto is not None:
+            params['mailto'] = self.mailto
+        return params
+
+    async def fetch(self, dois):
+        results = {}
+        dois = list(dict.fromkeys(d.lower() for d in dois))
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch_batch(batch):
+            async with semaphore:
+                body = await self.get(self.base_url + 'works',
+                                      params=self._params(batch))
+            try:
+                results.update(await self.parse(parse_works, body))
+            except (ValueError, KeyError, TypeError) as e:
+                raise RequestError(f'works: {e!r}')
+
+        await asyncio.gather(*[fetch_batch(dois[i:i + self.BATCH_SIZE])
+                               for i in range(0, len(dois),
+                                              self.BATCH_SIZE)])
+        return results
@@ -0,0 +1,153 @@
+from pathlib import Path
+import asyncio
+import hashlib
+import os
+import re
+import aiofiles
+import aiohttp
+from aio_throttle import HostLimiter, backoff
+
+
+class DownloadError(Exception):
+    pass
+
+
+class Download:
+
+    def __init__(self, url, path, blob, size, headers):
+        self.url = url
+        self.path = path
+        self.blob = blob
+        self.size = size
+        self.headers = headers
+
+
+class Downloader:
+
+    # Streams responses to a partial file under root, hashing as it goes.
+    # Partial files are named after their URL, so an interrupted download
+    # is resumed with a Range request the next time it is attempted. The
+    # response's ETag or Last-Modified is kept next to the partial file and
+    # sent as If-Range, so a changed file is sent again in full.
+
+    CHUNK_SIZE = 256 * 1024
+    MAX_RETRIES = 3
+    MAX_PER_HOST = 4
+
+    limiter = HostLimiter(default=(None, MAX_PER_HOST))
+    # One download per partial file at a time: partial -> (lock, users)
+    _locks = {}
+
+    def __init__(self, session, root, ssl=None, limiter=None):
+        self.session = session
+        self.root = Path(root)
+        self.ssl = ssl
+        if limiter is not None:
+            self.limiter = limiter
+
+    def _partial(self, url):
+        return self.root.joinpath(
+            hashlib.sha256(str(url).encode('utf-8')).hexdigest() + '.part')
+
+    def _validator(self, partial):
+        return partial.with_name(partial.name + '.validator')
+
+    def _save_validator(self, partial, headers):
+        validator = headers.get('ETag')
+        if validator is None or validator.startswith('W/'):
+            # Weak ETags cannot be used with If-Range
+            validator = headers.get('Last-Modified')
+        if validator is None:
+            self._remove(self._validator(partial))
+        else:
+            self._validator(partial).write_text(validator)
+
+    def _remove(self, *paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    async def _hash_existing(self, path):
+        def read():
+            sha = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                    sha.update(chunk)
+            return sha
+        return await asyncio.to_thread(read)
+
+    async def _attempt(self, url, partial, cookies, headers):
+        headers = {**(headers or {})}
+        offset = partial.stat().st_size if partial.exists() else 0
+        if offset > 0:
+            validator = self._validator(partial)
+            if validator.exists():
+                headers['Range'] = f'bytes={offset}-'
+                headers['If-Range'] = validator.read_text()
+            else:
+                # Nothing to tell whether it is still the same file
+                offset = 0
+        async with self.limiter.request(url):
+            async with self.session.get(url, headers=headers, cookies=cookies,
+                                        ssl=self.ssl) as response:
+                if response.status == 206 and offset > 0:
+                    match = re.match(r'bytes\s+(\d+)-', response.headers.get(
+                        'Content-Range', ''))
+                    if match is None or int(match[1]) != offset:
+                        # Not the rest of our partial file, start over
+                        self._remove(partial, self._validator(partial))
+                        return None
+                    sha = await self._hash_existing(partial)
+                    mode = 'ab'
+                elif response.status == 200:
+                    sha = hashlib.sha256()
+                    offset = 0
+                    mode = 'wb'
+                    self._save_validator(partial, response.headers)
+                elif response.status == 416 and offset > 0:
+                    # The partial file is no use, start over
+                    self._remove(partial, self._validator(partial))
+                    return None
+                else:
+                    raise DownloadError(f'{url}: {response.status}')
+                size = offset
+                async with aiofiles.open(str(partial), mode) as f:
+                    async for chunk in response.content.iter_chunked(
+                            self.CHUNK_SIZE):
+                        sha.update(chunk)
+                        await f.write(chunk)
+                        size += len(chunk)
+                self._remove(self._validator(partial))
+                return Download(url, partial, sha.hexdigest(), size,
+                                response.headers)
+
+    async def fetch(self, url, cookies=None, headers=None):
+        self.root.mkdir(parents=True, exist_ok=True)
+        partial = self._partial(url)
+        lock, users = self._locks.get(partial, (asyncio.Lock(), 0))
+        self._locks[partial] = (lock, users + 1)
+        try:
+            async with lock:
+                return await self._fetch(url, partial, cookies, headers)
+        finally:
+            lock, users = self._locks[partial]
+            if users == 1:
+                del self._locks[partial]
+            else:
+                self._locks[partial] = (lock, users - 1)
+
+    async def _fetch(self, url, partial, cookies, headers):
+        attempt = 0
+        while True:
+            try:
+                download = await self._attempt(url, partial, cookies, headers)
+                if download is not None:
+                    return download
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= self.MAX_RETRIES:
+                    raise DownloadError(f'{url}: {e!r}')
+                print(f'{url}: {e!r}, resuming')
+            await asyncio.sleep(backoff(attempt))
+            attempt += 1
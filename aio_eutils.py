@@ -0,0 +1,154 @@
+from datetime import datetime
+import xml.etree.ElementTree as ET
+import json
+import re
+from aio_parsepool import ParsePool
+from aio_http import RequestError
+
+
+def _text(elem, path):
+    found = elem.find(path)
+    if found is None:
+        return None
+    return ' '.join(''.join(found.itertext()).split())
+
+
+def _pubdate(article):
+    pubdate = article.find('MedlineCitation/Article/Journal/JournalIssue/'
+                           'PubDate')
+    if pubdate is None:
+        return None
+    year = _text(pubdate, 'Year')
+    month = _text(pubdate, 'Month')
+    day = _text(pubdate, 'Day')
+    if year is None:
+        # e.g. <MedlineDate>1998 Dec-1999 Jan</MedlineDate>
+        medline = _text(pubdate, 'MedlineDate')
+        if medline is None:
+            return None
+        match = re.match(r'(\d{4})\s*([A-Za-z]{3})?', medline)
+        if match is None:
+            return None
+        year, month, day = match[1], match[2], None
+    date = datetime(int(year), 1, 1)
+    if month is not None:
+        try:
+            if month.isdigit():
+                date = date.replace(month=int(month))
+            else:
+                date = date.replace(
+                    month=datetime.strptime(month[:3], '%b').month)
+        except ValueError:
+            return date.isoformat()
+        if day is not None and day.isdigit():
+            try:
+                date = date.replace(day=int(day))
+            except ValueError:
+                pass
+    return date.isoformat()
+
+
+def parse_efetch(xml):
+    results = []
+    for article in ET.fromstring(xml).iter('PubmedArticle'):
+        result = {'doi': None, 'pmid': None, 'title': None, 'authors': [],
+                  'journal': None, 'date': None}
+        result['pmid'] = _text(article, 'MedlineCitation/PMID')
+        for aid in article.iterfind('PubmedData/ArticleIdList/ArticleId'):
+            if aid.get('IdType') == 'doi' and aid.text is not None:
+                result['doi'] = aid.text.strip()
+        title = _text(article, 'MedlineCitation/Article/ArticleTitle')
+        if title is not None:
+            result['title'] = title.rstrip('.')
+        result['journal'] = _text(article,
+                                  'MedlineCitation/Article/Journal/Title')
+        result['date'] = _pubdate(article)
+        for author in article.iterfind(
+                'MedlineCitation/Article/AuthorList/Author'):
+            last = _text(author, 'LastName')
+            if last is None:
+                collective = _text(author, 'CollectiveName')
+                if collective is not None:
+                    result['authors'].append(collective)
+                continue
+            first = _text(author, 'ForeName')
+            if first is not None:
+                result['authors'].append(first + ' ' + last)
+            else:
+                result['authors'].append(last)
+        results.append(result)
+    return results
+
+
+class EUtils:
+
+    BASE_URL = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+    TOOL = 'pyread'
+
+    # EFetch takes a few hundred ids per request, but DOIs have to go
+    # through ESearch as an OR query, which is limited by the URL length.
+    BATCH_SIZE = 200
+    DOI_BATCH_SIZE = 50
+
+    def __init__(self, get, api_key=None, email=None, base_url=None,
+                 parse=None):
+        # get(url, params=...) -> bytes, raising on failure
+        self.get = get
+        # parse(fn, body) -> fn(body), by default on the shared ParsePool
+        if parse is None:
+            parse = ParsePool.shared().run
+        self.parse = parse
+        self.api_key = api_key
+        self.email = email
+        if base_url is None:
+            base_url = self.BASE_URL
+        self.base_url = base_url
+
+    def _params(self, **params):
+        params = {'db': 'pubmed', 'tool': self.TOOL, **params}
+        if self.api_key is not None:
+            params['api_key'] = self.api_key
+        if self.email is not None:
+            params['email'] = self.email
+        return params
+
+    async def search(self, term, retmax=20):
+        body = await self.get(self.base_url + 'esearch.fcgi',
+                              params=self._params(term=term, retmode='json',
+                                                  retmax=str(retmax)))
+        # Errors come back as 200s with an error body, e.g. HTML or
+        # {"error": ...} instead of an esearchresult
+        try:
+            return json.loads(body)['esearchresult']['idlist']
+        except (ValueError, KeyError, TypeError) as e:
+            raise RequestError(f'esearch: {e!r}')
+
+    async def fetch(self, pmids):
+        results = {}
+        pmids = list(dict.fromkeys(str(p) for p in pmids))
+        for i in range(0, len(pmids), self.BATCH_SIZE):
+            body = await self.get(
+                self.base_url + 'efetch.fcgi',
+                params=self._params(id=','.join(pmids[i:i + self.BATCH_SIZE]),
+                                    retmode='xml'))
+            try:
+                parsed = await self.parse(parse_efetch, body)
+            except ET.ParseError as e:
+                raise RequestError(f'efetch: {e!r}')
+            for result in parsed:
+                results[result['pmid']] = result
+        return results
+
+    async def fetch_dois(self, dois):
+        results = {}
+        dois = list(dict.fromkeys(d.lower() for d in dois))
+        for i in range(0, len(dois), self.DOI_BATCH_SIZE):
+            batch = dois[i:i + self.DOI_BATCH_SIZE]
+            pmids = await self.search(' OR '.join(f'"{d}"[aid]'
+                                                  for d in batch),
+                                      retmax=2 * len(batch))
+            for result in (await self.fetch(pmids)).values():
+                if (result['doi'] is not None and
+                        result['doi'].lower() in batch):
+                    results[result['doi'].lower()] = result
+        return results
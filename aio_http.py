@@ -0,0 +1,152 @@
+import time
+import aiohttp
+
+
+class RequestError(Exception):
+
+    # A request that failed for good, or whose response could not be used
+
+    pass
+
+
+class PoolStats:
+
+    # Fed by aiohttp's request tracing, so no private connector state is
+    # needed to see how a pool is doing
+
+    def __init__(self):
+        self.requests = 0
+        self.active = 0
+        self.errors = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.queued = 0
+        self.queue_wait = 0
+        self.max_queue_wait = 0
+        self.dns_hits = 0
+        self.dns_misses = 0
+
+    def trace_config(self):
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(self._request_start)
+        trace.on_request_end.append(self._request_end)
+        trace.on_request_exception.append(self._request_exception)
+        trace.on_connection_queued_start.append(self._queued_start)
+        trace.on_connection_queued_end.append(self._queued_end)
+        trace.on_connection_create_end.append(self._create_end)
+        trace.on_connection_reuseconn.append(self._reuseconn)
+        trace.on_dns_cache_hit.append(self._dns_hit)
+        trace.on_dns_cache_miss.append(self._dns_miss)
+        return trace
+
+    async def _request_start(self, session, ctx, params):
+        self.requests += 1
+        self.active += 1
+
+    async def _request_end(self, session, ctx, params):
+        self.active -= 1
+
+    async def _request_exception(self, session, ctx, params):
+        self.active -= 1
+        self.errors += 1
+
+    async def _queued_start(self, session, ctx, params):
+        self.queued += 1
+        ctx.queued_at = time.monotonic()
+
+    async def _queued_end(self, session, ctx, params):
+        wait = time.monotonic() - ctx.queued_at
+        self.queue_wait += wait
+        self.max_queue_wait = max(self.max_queue_wait, wait)
+
+    async def _create_end(self, session, ctx, params):
+        self.connections_created += 1
+
+    async def _reuseconn(self, session, ctx, params):
+        self.connections_reused += 1
+
+    async def _dns_hit(self, session, ctx, params):
+        self.dns_hits += 1
+
+    async def _dns_miss(self, session, ctx, params):
+        self.dns_misses += 1
+
+    def as_dict(self):
+        return {**vars(self)}
+
+
+class HttpClient:
+
+    # One session per kind of traffic, each with its own connection pool
+    # and timeouts, so that a burst of downloads or proxied pages cannot
+    # starve metadata lookups (or the other way round). Sessions are
+    # shared by everything using the same pool.
+
+    DNS_TTL = 300
+    KEEPALIVE_TIMEOUT = 30
+
+    # pool -> (total connections, connections per host, ClientTimeout)
+    POOLS = {'metadata': (32, 8, aiohttp.ClientTimeout(total=60, connect=10,
+                                                       sock_read=30)),
+             'download': (32, 4, aiohttp.ClientTimeout(total=None,
+                                                       connect=10,
+                                                       sock_read=60)),
+             'proxy': (64, 16, aiohttp.ClientTimeout(total=None, connect=10,
+                                                     sock_read=60))}
+
+    # Proxied bodies are relayed still encoded
+    SESSION_OPTIONS = {'proxy': {'auto_decompress': False}}
+
+    def __init__(self, pools=None):
+        if pools is not None:
+            self.POOLS = {**self.POOLS, **pools}
+        self._sessions = {}
+        self._stats = {}
+
+    def _create(self, name):
+        limit, limit_per_host, timeout = self.POOLS[name]
+        connector = aiohttp.TCPConnector(
+            limit=limit, limit_per_host=limit_per_host,
+            ttl_dns_cache=self.DNS_TTL, use_dns_cache=True,
+            keepalive_timeout=self.KEEPALIVE_TIMEOUT)
+        stats = PoolStats()
+        self._stats[name] = stats
+        return aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                     trace_configs=[stats.trace_config()],
+                                     **self.SESSION_OPTIONS.get(name, {}))
+
+    async def start(self):
+        for name in self.POOLS:
+            self.session(name)
+
+    def session(self, name):
+        session = self._sessions.get(name)
+        if session is None or session.closed:
+            session = self._create(name)
+            self._sessions[name] = session
+        return session
+
+    def extra_session(self, name, **options):
+        # Another session on the same pool and connections, e.g. with a
+        # cookie jar of its own; closing it leaves the pool open
+        pool = self.session(name)
+        _, _, timeout = self.POOLS[name]
+        return aiohttp.ClientSession(
+            connector=pool.connector, connector_owner=False,
+            timeout=timeout,
+            trace_configs=[self._stats[name].trace_config()],
+            **{**self.SESSION_OPTIONS.get(name, {}), **options})
+
+    def stats(self):
+        result = {}
+        for name in self._sessions:
+            limit, limit_per_host, _ = self.POOLS[name]
+            result[name] = {'limit': limit,
+                            'limit_per_host': limit_per_host,
+                            **self._stats[name].as_dict()}
+        return result
+
+    async def close(self):
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions = {}
@@ -0,0 +1,279 @@
+from pathlib import Path
+import asyncio
+import json
+import aiosqlite
+
+
+class MetaDB:
+
+    DB_LOCATION = 'files/pyread.db'
+
+    TABLE = 'ref_database'
+
+    # DOIs are case-insensitive, so they are compared (and kept unique)
+    # without regard to case but stored as given
+    COLS = {'doi': 'varchar(255) COLLATE NOCASE',
+            'pmid': 'int',
+            'title': 'text',
+            'authors': 'text',
+            'journal': 'varchar(255)',
+            'date': 'char(19)',
+            'local': 'char'}
+
+    # Writes are committed together once this many are pending, or after
+    # COMMIT_DELAY seconds, whichever comes first.
+    COMMIT_DELAY = 0.5
+    COMMIT_BATCH = 100
+
+    # sqlite3 keeps a per-connection cache of prepared statements keyed on
+    # the SQL text, so every query below is built once and reused verbatim.
+    STATEMENT_CACHE = 256
+
+    SQL_COLUMNS = ','.join([' '.join([k, v]) for k, v in COLS.items()])
+    SQL_CREATE = f'CREATE TABLE IF NOT EXISTS {TABLE} ({SQL_COLUMNS})'
+    SQL_COLS = ','.join(COLS)
+    SQL_SET = ','.join([k + ' = ?' for k in COLS])
+    SQL_SELECT = {'doi': f'SELECT {SQL_COLS} FROM {TABLE} WHERE doi=?',
+                  'pmid': f'SELECT {SQL_COLS} FROM {TABLE} WHERE pmid=?'}
+    SQL_INSERT = (f'INSERT INTO {TABLE} ({SQL_COLS}) VALUES (' +
+                  ','.join(['?'] * len(COLS)) + ')')
+    SQL_UPDATE = {'doi': f'UPDATE {TABLE} SET {SQL_SET} WHERE doi=?',
+                  'pmid': f'UPDATE {TABLE} SET {SQL_SET} WHERE pmid=?'}
+    # On conflict, merge keeps whatever is already stored for columns the
+    # new entry leaves empty, while replace overwrites every column.
+    SQL_MERGE = ','.join([f'{k} = coalesce(excluded.{k}, {k})'
+                          for k in COLS if k != 'local'] +
+                         ['local = excluded.local'])
+    SQL_REPLACE = ','.join([f'{k} = excluded.{k}' for k in COLS])
+    SQL_UPSERT = {'merge': (SQL_INSERT +
+                            f' ON CONFLICT(doi) DO UPDATE SET {SQL_MERGE}'
+                            f' ON CONFLICT(pmid) DO UPDATE SET {SQL_MERGE}'),
+                  'replace': (SQL_INSERT +
+                              f' ON CONFLICT(doi) DO UPDATE SET {SQL_REPLACE}'
+                              f' ON CONFLICT(pmid) DO UPDATE SET '
+                              f'{SQL_REPLACE}')}
+    SQL_DELETE_PMID = f'DELETE FROM {TABLE} WHERE pmid=?'
+    SQL_CLEAR_PMID = f'UPDATE {TABLE} SET pmid = NULL WHERE pmid=?'
+    # SQLite limits the number of bound parameters per statement
+    BATCH_SIZE = 500
+
+    # Applied in order; PRAGMA user_version records how many have run.
+    MIGRATIONS = [
+        [f'DELETE FROM {TABLE} WHERE doi IS NOT NULL AND rowid NOT IN '
+         f'(SELECT MAX(rowid) FROM {TABLE} WHERE doi IS NOT NULL '
+         f'GROUP BY doi)',
+         f'DELETE FROM {TABLE} WHERE pmid IS NOT NULL AND rowid NOT IN '
+         f'(SELECT MAX(rowid) FROM {TABLE} WHERE pmid IS NOT NULL '
+         f'GROUP BY pmid)',
+         f'CREATE UNIQUE INDEX IF NOT EXISTS {TABLE}_doi ON {TABLE} (doi)',
+         f'CREATE UNIQUE INDEX IF NOT EXISTS {TABLE}_pmid ON {TABLE} (pmid)'],
+        ['CREATE TABLE IF NOT EXISTS blobs (hash char(64) PRIMARY KEY, '
+         'size int, refs int)',
+         'CREATE TABLE IF NOT EXISTS blob_sources (url text PRIMARY KEY, '
+         'hash char(64), name text, ftype int)'],
+        ['CREATE TABLE IF NOT EXISTS article_sections (article text, '
+         'section varchar(32), data text, version int, '
+         'PRIMARY KEY (article, section))'],
+        ['CREATE TABLE IF NOT EXISTS doi_urls (doi text PRIMARY KEY, '
+         'url text, resolved text)'],
+        # Rebuilt with the NOCASE doi column, keeping one row per DOI (the
+        # local one if there is one, else the newest)
+        [f'CREATE TABLE {TABLE}_nocase ({SQL_COLUMNS})',
+         f'INSERT INTO {TABLE}_nocase SELECT {SQL_COLS} FROM '
+         f'(SELECT *, rowid AS old_rowid, row_number() OVER '
+         f"(PARTITION BY doi COLLATE NOCASE ORDER BY local = 'T' DESC, "
+         f'rowid DESC) AS n FROM {TABLE}) '
+         f'WHERE doi IS NULL OR n = 1 ORDER BY old_rowid',
+         f'DROP TABLE {TABLE}',
+         f'ALTER TABLE {TABLE}_nocase RENAME TO {TABLE}',
+         f'CREATE UNIQUE INDEX {TABLE}_doi ON {TABLE} (doi)',
+         f'CREATE UNIQUE INDEX {TABLE}_pmid ON {TABLE} (pmid)']
+    ]
+
+    _shared = {}
+
+    def __init__(self, location=None):
+        if location is None:
+            location = self.DB_LOCATION
+        self.location = location
+        self._conn = None
+        self._connect_lock = asyncio.Lock()
+        self._pending = 0
+        self._commit_task = None
+
+    @classmethod
+    def shared(cls, location=None):
+        if location is None:
+            location = cls.DB_LOCATION
+        db = cls._shared.get(location)
+        if db is None:
+            db = cls(location)
+            cls._shared[location] = db
+        return db
+
+    async def connect(self):
+        if self._conn is not None:
+            return self._conn
+        async with self._connect_lock:
+            if self._conn is None:
+                Path(self.location).parent.mkdir(parents=True, exist_ok=True)
+                conn = await aiosqlite.connect(
+                    self.location, cached_statements=self.STATEMENT_CACHE)
+                await conn.execute('PRAGMA journal_mode=WAL')
+                await conn.execute('PRAGMA synchronous=NORMAL')
+                await conn.execute(self.SQL_CREATE)
+                await self._migrate(conn)
+                await conn.commit()
+                self._conn = conn
+        return self._conn
+
+    async def _migrate(self, conn):
+        async with conn.execute('PRAGMA user_version') as cursor:
+            version = (await cursor.fetchone())[0]
+        for migration in self.MIGRATIONS[version:]:
+            for statement in migration:
+                await conn.execute(statement)
+        if version < len(self.MIGRATIONS):
+            await conn.execute(f'PRAGMA user_version = {len(self.MIGRATIONS)}')
+
+    async def _written(self):
+        self._pending += 1
+        if self._pending >= self.COMMIT_BATCH:
+            await self.flush()
+        elif self._commit_task is None:
+            self._commit_task = asyncio.ensure_future(self._delayed_commit())
+
+    async def _delayed_commit(self):
+        await asyncio.sleep(self.COMMIT_DELAY)
+        self._commit_task = None
+        await self.flush()
+
+    async def flush(self):
+        if self._commit_task is not None:
+            self._commit_task.cancel()
+            self._commit_task = None
+        if self._conn is not None and self._pending > 0:
+            self._pending = 0
+            await self._conn.commit()
+
+    async def close(self):
+        await self.flush()
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+        if self._shared.get(self.location) is self:
+            del self._shared[self.location]
+
+    def _to_row(self, entry):
+        new_entry = {**entry}
+        if entry.get('pmid') is not None:
+            new_entry['pmid'] = int(entry['pmid'])
+        if entry.get('local') is True:
+            new_entry['local'] = 'T'
+        else:
+            new_entry['local'] = 'F'
+        if entry.get('authors') is not None:
+            new_entry['authors'] = json.dumps(entry['authors'])
+        return tuple(new_entry.get(k) for k in self.COLS.keys())
+
+    def _from_row(self, row):
+        new_entry = {}
+        for k, e in zip(self.COLS.keys(), row):
+            if k == 'pmid':
+                if e is not None:
+                    e = str(e)
+            elif k == 'local':
+                e = e == 'T'
+            elif k == 'authors':
+                if e is not None:
+                    e = json.loads(e)
+            new_entry[k] = e
+        return new_entry
+
+    async def execute(self, sql, params=()):
+        conn = await self.connect()
+        await conn.execute(sql, params)
+        await self._written()
+
+    async def fetchall(self, sql, params=()):
+        conn = await self.connect()
+        async with conn.execute(sql, params) as cursor:
+            return await cursor.fetchall()
+
+    async def get(self, entry):
+        conn = await self.connect()
+        for key in ['doi', 'pmid']:
+            if entry.get(key) is None:
+                continue
+            async with conn.execute(self.SQL_SELECT[key],
+                                    (entry[key],)) as cursor:
+                row = await cursor.fetchone()
+            if row is not None:
+                return self._from_row(row), key
+        return {}, None
+
+    async def get_many(self, values, key='doi'):
+        values = list(dict.fromkeys(v for v in values if v is not None))
+        if key == 'pmid':
+            values = [int(v) for v in values]
+        # DOIs match in any case, but come back under the one asked for
+        asked = {}
+        if key == 'doi':
+            asked = {v.lower(): v for v in values}
+        conn = await self.connect()
+        result = {}
+        for i in range(0, len(values), self.BATCH_SIZE):
+            batch = values[i:i + self.BATCH_SIZE]
+            sql = (f'SELECT {self.SQL_COLS} FROM {self.TABLE} '
+                   f'WHERE {key} IN (' + ','.join(['?'] * len(batch)) + ')')
+            async with conn.execute(sql, batch) as cursor:
+                for row in await cursor.fetchall():
+                    entry = self._from_row(row)
+                    value = entry[key]
+                    if key == 'doi':
+                        value = asked[value.lower()]
+                    result[value] = entry
+        return result
+
+    async def upsert(self, entry, overwrite=False):
+        # Without a doi or pmid the row could never be looked up again
+        if entry.get('doi') is None and entry.get('pmid') is None:
+            return
+        conn = await self.connect()
+        sql = self.SQL_UPSERT['replace' if overwrite else 'merge']
+        try:
+            await conn.execute(sql, self._to_row(entry))
+        except aiosqlite.IntegrityError:
+            # The doi is on one row and the pmid on another
+            entry = await self._take_pmid(conn, entry, overwrite)
+            await conn.execute(sql, self._to_row(entry))
+        await self._written()
+
+    async def _take_pmid(self, conn, entry, overwrite):
+        pmid = int(entry['pmid'])
+        async with conn.execute(self.SQL_SELECT['pmid'], (pmid,)) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            raise aiosqlite.IntegrityError(f'{entry} conflicts with no row')
+        other = self._from_row(row)
+        if other['doi'] is not None:
+            # Another article had the pmid, the newer entry is trusted
+            await conn.execute(self.SQL_CLEAR_PMID, (pmid,))
+            return entry
+        # The same article, stored before its doi was known
+        await conn.execute(self.SQL_DELETE_PMID, (pmid,))
+        if overwrite:
+            return entry
+        return {**other, **{k: v for k, v in entry.items() if v is not None},
+                'local': entry.get('local')}
+
+    async def insert(self, entry):
+        conn = await self.connect()
+        await conn.execute(self.SQL_INSERT, self._to_row(entry))
+        await self._written()
+
+    async def update(self, entry, key='doi'):
+        conn = await self.connect()
+        await conn.execute(self.SQL_UPDATE[key],
+                           self._to_row(entry) + (entry[key],))
+        await self._written()
@@ -0,0 +1,59 @@
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import os
+
+
+def _warm():
+    # Importing the parsers up front keeps the first real job from
+    # paying for it
+    import aio_eutils  # noqa: F401
+    import aio_crossref  # noqa: F401
+    import bs4  # noqa: F401
+    return os.getpid()
+
+
+class ParsePool:
+
+    # Parse jobs are module-level functions that take the raw response
+    # body and return plain dicts, so they can run in another process.
+    # Until start() is called they simply run inline.
+
+    # Each worker is a full interpreter with the parsers loaded, so unless
+    # asked for more, a handful is plenty even on a large machine
+    WORKERS = os.environ.get('PYREAD_PARSE_WORKERS')
+    MAX_WORKERS = 4
+
+    _shared = None
+
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = self.WORKERS
+        if workers is None:
+            workers = min(self.MAX_WORKERS, os.cpu_count() or 1)
+        self.workers = int(workers)
+        self._executor = None
+
+    @classmethod
+    def shared(cls):
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    async def start(self):
+        if self._executor is not None or self.workers < 1:
+            return
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self._executor, _warm)
+                               for _ in range(self.workers)])
+
+    async def run(self, fn, *args):
+        if self._executor is None:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, fn, *args)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -3,19 +3,38 @@ __version__ = '0.2'
 import asyncio
 from aiohttp import web
 import aiohttp
-import aiofiles
 from yarl import URL
 import ssl
 import certifi
 import http
-from aio_articleparser import Article, ArticleItem
+from aio_articleparser import (Article, ArticleItem, FileChangedError,
+                               FileTypeError, verify_library)
+from aio_metadb import MetaDB
+from aio_parsepool import ParsePool
+from aio_blobstore import BlobStore
+from aio_download import DownloadError
+from aio_http import HttpClient, RequestError
+from aio_resolver import DoiResolver
+from aio_assets import AssetCache, CompressedBody, MIME_TYPES
+from aio_sections import (JsonSectionStore, SqliteSectionStore,
+                          migrate_sections, section_store)
 import json
 from pathlib import Path
+from collections import OrderedDict
 from collections.abc import MutableMapping
 import arsenic_hacks as arsenic
 import time
 import re
-from bs4 import BeautifulSoup
+import zlib
+import html
+import sys
+import os
+import secrets
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Workaround to use cookies with illegal keys with aiohttp
 http.cookies._is_legal_key = lambda _: True
@@ -27,118 +46,436 @@ CAPABILITIES = ['sciencedirect.com', 'nature.com', 'academic.oup.com']
 
 class PyrCache(MutableMapping):
 
-    def __init__(self, max_size, *args, **kwargs):
-        content = {}.update(*args, **kwargs)
+    def __init__(self, max_size, *args, max_bytes=None, ttl=None,
+                 sizeof=None, on_evict=None, **kwargs):
         self._max_size = max_size
-        self._counter = 0
-        if content is None:
-            self.content = {}
-        else:
-            for k, v in content.items():
-                self.content[k] = {'counter': self._counter, 'value': v}
-                self.counter += 1
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        if sizeof is None:
+            sizeof = lambda _: 0
+        self._sizeof = sizeof
+        # Called with (key, value) for entries dropped by the cache itself
+        self._on_evict = on_evict
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # key -> [value, size, expiry]; ordered from least to most recent
+        self.content = OrderedDict()
+        self.update(*args, **kwargs)
+
+    def _expired(self, item):
+        return item[2] is not None and item[2] <= time.monotonic()
+
+    def _remove(self, key):
+        item = self.content.pop(key)
+        self._bytes -= item[1]
+        return item
+
+    def _evict(self, key):
+        item = self._remove(key)
+        if self._on_evict is not None:
+            self._on_evict(key, item[0])
+
+    def _trim(self):
+        while len(self.content) > 1 and (
+                len(self.content) > self._max_size or
+                (self._max_bytes is not None and
+                 self._bytes > self._max_bytes)):
+            self._evict(next(iter(self.content)))
+            self.evictions += 1
+
+    def expire(self):
+        for key in [k for k, v in self.content.items() if self._expired(v)]:
+            self._evict(key)
+            self.expirations += 1
 
     def __getitem__(self, key):
-        self._counter += 1
-        self.content[key]['counter'] = self._counter
-        return self.content[key]['value']
+        item = self.content.get(key)
+        if item is None:
+            self.misses += 1
+            raise KeyError(key)
+        if self._expired(item):
+            self._evict(key)
+            self.expirations += 1
+            self.misses += 1
+            raise KeyError(key)
+        self.hits += 1
+        self.content.move_to_end(key)
+        return item[0]
 
     def __setitem__(self, key, value):
-        self._counter += 1
-        if key not in self.content:
-            self.content[key] = {}
-        self.content[key]['counter'] = self._counter
-        self.content[key]['value'] = value
-        if len(self.content) > self._max_size:
-            min_counter = -1
-            to_delete = ''
-            for k, v in self.content.items():
-                if min_counter == -1 or v['counter'] < min_counter:
-                    min_counter = v['counter']
-                    to_delete = k
-            del(self.content[to_delete])
+        self.set(key, value)
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self._ttl
+        if key in self.content:
+            self._remove(key)
+        size = self._sizeof(value)
+        expiry = None if ttl is None else time.monotonic() + ttl
+        self.content[key] = [value, size, expiry]
+        self._bytes += size
+        self._trim()
+
+    def resize(self, key):
+        # Values such as Article grow after they are cached (files get
+        # loaded on demand), so callers re-measure them once they have.
+        item = self.content.get(key)
+        if item is None:
+            return
+        size = self._sizeof(item[0])
+        self._bytes += size - item[1]
+        item[1] = size
+        self.content.move_to_end(key)
+        self._trim()
 
     def __delitem__(self, key):
-        del(self.content[key])
+        self._remove(key)
+
+    def __contains__(self, key):
+        item = self.content.get(key)
+        return item is not None and not self._expired(item)
+
+    # Expired entries are only dropped when touched, so anything that
+    # reports on the whole cache expires them first
 
     def __iter__(self):
-        return iter({k: v['value'] for k, v in self.content.items()})
+        self.expire()
+        return iter(list(self.content))
 
     def __len__(self):
+        self.expire()
         return len(self.content)
 
+    @property
+    def nbytes(self):
+        self.expire()
+        return self._bytes
+
+    def stats(self):
+        self.expire()
+        return {'size': len(self.content),
+                'max_size': self._max_size,
+                'bytes': self._bytes,
+                'max_bytes': self._max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations}
+
     def __str__(self):
-        return (f'<CACHE MAX_SIZE={self._max_size} ' +
-                str({k: v['value'] for k, v in self.content.items()}) + '>')
+        return (f'<CACHE MAX_SIZE={self._max_size} '
+                f'MAX_BYTES={self._max_bytes} ' +
+                str({k: v[0] for k, v in self.content.items()}) + '>')
 
     def __repr__(self):
         return str(self)
 
 
-class AIOProxy:
+class PageHead:
 
-    FILE_EXTENSIONS = {'.js': 'text/javascript',
-                       '.css': 'text/css',
-                       '.html': 'text/html',
-                       '.png': 'image/png',
-                       '.jpg': 'image/jpeg'}
+    # Just enough of an HTML <head> to pick a scraper, read with byte
+    # regexes rather than a full parse of the page
 
-    ARTICLE_CACHE_SIZE = 50
-    ACTIVE_TIMEOUT = 10
+    HEAD_END_RE = re.compile(rb'</head\s*>', re.I)
+    TITLE_RE = re.compile(rb'<title[^>]*>(.*?)</title\s*>', re.I | re.S)
+    META_RE = re.compile(rb'<meta\s([^>]*)>', re.I)
+    ATTR_RE = re.compile(rb'([\w:.-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|'
+                         rb'([^\s"\'>]+))')
 
-    def __init__(self):
-        self.netloc = ''
-        self.cookies = ''
-        self.cache = PyrCache(self.ARTICLE_CACHE_SIZE)
-        self.active_tab = 0
+    def __init__(self, body):
+        match = self.HEAD_END_RE.search(body)
+        if match is None:
+            self.end = -1
+            head = body
+        else:
+            self.end = match.start()
+            head = body[:self.end]
+        title = self.TITLE_RE.search(head)
+        if title is not None:
+            self.title = self._text(title.group(1)).strip()
+        else:
+            self.title = None
+        self.meta = {}
+        for tag in self.META_RE.finditer(head):
+            attrs = {}
+            for a in self.ATTR_RE.finditer(tag.group(1)):
+                value = a.group(2) or a.group(3) or a.group(4) or b''
+                attrs[self._text(a.group(1)).lower()] = self._text(value)
+            key = attrs.get('name', attrs.get('property'))
+            if key is not None and 'content' in attrs:
+                self.meta[key] = attrs['content']
+
+    def _text(self, value):
+        return html.unescape(value.decode('utf-8', 'replace'))
+
+
+def dumps(obj):
+    # orjson when it is installed, it is several times faster on the
+    # large content and reference lists
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+
+def etag_matches(header, etag):
+    if header is None:
+        return False
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*' or tag.removeprefix('W/') == f'"{etag}"':
+            return True
+    return False
+
+
+class ProxyContext:
+
+    # What one reader is proxying: the publisher's origin, the request
+    # headers and cookies it was opened with, and a client session whose
+    # cookie jar keeps whatever the publisher sets afterwards
+
+    def __init__(self, key, session):
+        self.key = key
+        self.session = session
+        self.origin = None
+        self.cookies = {}
         self.headers = {}
 
-    def _get_parser(self, html):
-        soup = BeautifulSoup(html, 'lxml')
+    def open(self, location, user_agent, cookies=None):
+        self.origin = str(location.origin())
+        self.headers = {'User-Agent': user_agent}
+        if cookies is not None:
+            self.cookies = cookies
+            self.session.cookie_jar.update_cookies(cookies, URL(self.origin))
+
+    def cookies_for(self, url):
+        # The cookies it was opened with, plus those the publisher has set
+        # since that apply to url
+        cookies = dict(self.cookies)
+        jar = self.session.cookie_jar.filter_cookies(URL(url))
+        for name, morsel in jar.items():
+            cookies[name] = morsel.value
+        return cookies
+
+    def close(self):
+        return asyncio.ensure_future(self.session.close())
+
 
-        def sciencedirect():
-            return (soup.title.string.endswith('ScienceDirect'))
+class AIOProxy:
+
+    # Scraper script -> test run against the PageHead of each proxied page
+    SCRAPERS = {'sciencedirect.js':
+                lambda head: (head.title is not None and
+                              head.title.endswith('ScienceDirect')),
+                'nature.js':
+                lambda head: head.meta.get('application-name') == 'Nature',
+                'oxford.js':
+                lambda head: head.meta.get('og:site_name') == 'OUP Academic'}
+
+    # Asset links served by us carry a version tag; requests with the
+    # current tag may be cached for good, anything else is revalidated
+    ASSET_MAX_AGE = 365 * 24 * 3600
+    ASSET_LINK_RE = re.compile(r'/pyreadasset\?file=([\w./-]+)')
+
+    FILE_EXTENSIONS = MIME_TYPES
+
+    # Request headers forwarded upstream and response headers passed back
+    # to the browser when streaming non-HTML content
+    PROXY_REQUEST_HEADERS = ['Range', 'If-Range', 'If-None-Match',
+                             'If-Modified-Since']
+    PROXY_RESPONSE_HEADERS = ['Content-Type', 'Content-Length',
+                              'Content-Encoding', 'Content-Range',
+                              'Content-Disposition', 'Accept-Ranges',
+                              'ETag', 'Last-Modified', 'Cache-Control',
+                              'Expires']
+    # Only encodings _decode can undo are requested, since HTML bodies
+    # have to be decompressed before the scripts are injected
+    PROXY_ACCEPT_ENCODING = 'gzip, deflate'
+    PROXY_CHUNK_SIZE = 64 * 1024
+
+    # What adding a scraped file is expected to fail with; these are sent
+    # back to the scraper per file, anything else is a server error
+    FILE_ERRORS = (FileTypeError, FileChangedError, DownloadError,
+                   RequestError, aiohttp.ClientError, asyncio.TimeoutError)
 
-        def nature():
-            app_name = soup.find('meta', {'name': 'application-name'})
-            return app_name is not None and app_name['content'] == 'Nature'
+    ARTICLE_CACHE_SIZE = 50
+    ARTICLE_CACHE_BYTES = 512 * 1024 * 1024
+    ARTICLE_CACHE_TTL = None
+    ACTIVE_TIMEOUT = 10
 
-        def oxford():
-            site_name = soup.find('meta', {'property': 'og:site_name'})
-            return (site_name is not None and
-                    site_name['content'] == 'OUP Academic')
+    # Every /pyreadproxy opens a ProxyContext of its own, so tabs on
+    # different publishers do not share an origin or cookies. The tab's
+    # pages live under CONTEXT_PREFIX + id. Requests their pages make to
+    # other paths are found through Referer and fetched as they are; only
+    # navigations are redirected under the prefix. The cookie names the
+    # last context opened, for requests without Referer.
+    # Contexts are dropped after CONTEXT_IDLE_TIMEOUT s without a request.
+    CONTEXT_PREFIX = '/pyreadctx/'
+    CONTEXT_COOKIE = 'pyread_session'
+    CONTEXT_IDLE_TIMEOUT = 3600
+    MAX_CONTEXTS = 100
+    VERIFY_INTERVAL = 24 * 3600
+
+    # Headless Firefox sessions kept warm for /pyreadresolve
+    GECKODRIVER = os.environ.get('PYREAD_GECKODRIVER', 'geckodriver')
+    BROWSER_POOL_SIZE = int(os.environ.get('PYREAD_BROWSERS', 2))
+    BROWSER_MAX_USES = 25
+    BROWSER_RESOLVE_TIMEOUT = 10
+
+    def __init__(self, db=None, parser=None):
+        if db is None:
+            db = MetaDB.shared()
+        self.db = db
+        if parser is None:
+            parser = ParsePool.shared()
+        self.parser = parser
+        self.store = BlobStore(self.db)
+        self.sections = section_store(Article.SECTION_STORE, self.db)
+        self.assets = AssetCache()
+        self.http = HttpClient()
+        self.cache = PyrCache(self.ARTICLE_CACHE_SIZE,
+                              max_bytes=self.ARTICLE_CACHE_BYTES,
+                              ttl=self.ARTICLE_CACHE_TTL,
+                              sizeof=lambda a: a.resident_size())
+        self.contexts = PyrCache(self.MAX_CONTEXTS,
+                                 ttl=self.CONTEXT_IDLE_TIMEOUT,
+                                 on_evict=lambda _, c: c.close())
+        self.browsers = arsenic.PyrBrowserPool(
+            self._start_browser, size=self.BROWSER_POOL_SIZE,
+            max_uses=self.BROWSER_MAX_USES)
+        self.active_tab = 0
 
-        parsers = {'sciencedirect.js': sciencedirect, 'nature.js': nature,
-                   'oxford.js': oxford}
-        for fname, test in parsers.items():
-            if test():
+    def _new_article(self, context=None):
+        cookies, headers = {}, {}
+        if context is not None:
+            cookies, headers = context.cookies, context.headers
+        return Article(self.session, cookies, headers, db=self.db,
+                       parser=self.parser, store=self.store,
+                       sections=self.sections,
+                       download_session=self.download_session)
+
+    async def _start_browser(self):
+        service = arsenic.PyrGeckodriver(binary=self.GECKODRIVER)
+        browser = arsenic.PyrFirefox(**{'moz:firefoxOptions':
+                                     {'args': ['-headless']}})
+        return await arsenic.pyr_start_session(service, browser)
+
+    def _split_path(self, path):
+        # '/pyreadctx/<id>/rest' -> ('<id>', '/rest')
+        if not path.startswith(self.CONTEXT_PREFIX):
+            return None, path
+        key, _, rest = path[len(self.CONTEXT_PREFIX):].partition('/')
+        return key, '/' + rest
+
+    def _is_navigation(self, request):
+        mode = request.headers.get('Sec-Fetch-Mode')
+        if mode is not None:
+            return mode == 'navigate'
+        # Browsers without Fetch Metadata only ask for HTML when loading a
+        # page (or a frame)
+        return 'text/html' in request.headers.get('Accept', '')
+
+    def _context(self, request, create=False):
+        self.contexts.expire()
+        if create:
+            key = secrets.token_urlsafe(16)
+            context = ProxyContext(key, self.http.extra_session(
+                'proxy', cookie_jar=aiohttp.CookieJar()))
+            self.contexts[key] = context
+            return context
+        key, _ = self._split_path(request.rel_url.path)
+        if key is None and 'Referer' in request.headers:
+            key, _ = self._split_path(URL(request.headers['Referer']).path)
+        if key is None:
+            key = request.cookies.get(self.CONTEXT_COOKIE)
+        context = None
+        if key is not None:
+            context = self.contexts.get(key)
+        if context is not None:
+            # Set again to push back its expiry
+            self.contexts[key] = context
+        return context
+
+    @classmethod
+    def register_scraper(cls, fname, test):
+        cls.SCRAPERS = {**cls.SCRAPERS, fname: test}
+
+    def _get_parser(self, head):
+        for fname, test in self.SCRAPERS.items():
+            if test(head):
                 return fname
         return None
 
+    async def verify(self):
+        report = await verify_library(store=self.store,
+                                      sections=self.sections)
+        print(f"Verified {report['checked']} files: "
+              f"{len(report['changed'])} changed, "
+              f"{len(report['missing'])} missing")
+        for path in report['changed']:
+            print(f'CHANGED: {path}')
+        for path in report['missing']:
+            print(f'MISSING: {path}')
+        return report
+
+    async def verify_sweep(self):
+        while True:
+            try:
+                await self.verify()
+            except Exception as e:
+                print(f'Verify sweep failed: {e!r}')
+            await asyncio.sleep(self.VERIFY_INTERVAL)
+
     async def create_session(self):
-        self.session = aiohttp.ClientSession()
+        await self.http.start()
+        self.session = self.http.session('metadata')
+        self.download_session = self.http.session('download')
+        self.resolver = DoiResolver(self.session, self.db, CAPABILITIES,
+                                    browser_resolve=self._resolve_in_browser,
+                                    headers=Article.HEADERS, ssl=sslcontext)
+
+    def _decode(self, body, encoding):
+        if encoding in ('gzip', 'x-gzip'):
+            return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        if encoding == 'deflate':
+            try:
+                return zlib.decompress(body)
+            except zlib.error:
+                return zlib.decompress(body, -zlib.MAX_WBITS)
+        return body
 
     async def pyreadhome(self, request):
-        async with aiofiles.open('assets/index.html', 'r') as f:
-            return web.Response(text=await f.read(),
-                                content_type='text/html')
+        try:
+            index = await self.assets.get('index.html')
+        except FileNotFoundError:
+            raise web.HTTPNotFound
+        page = self.ASSET_LINK_RE.sub(lambda m: self.asset_url(m.group(1)),
+                                      index.body.decode('utf-8'))
+        return self._cached_response(request, page.encode('utf-8'),
+                                     'text/html')
 
     async def pyreadproxy(self, request):
-        self.headers = {'User-Agent': request.headers['User-Agent']}
         query = request.rel_url.query
         if 'location' not in query:
             raise web.HTTPBadRequest
         location = URL(query['location'])
-        self.netloc = location.scheme + '://' + location.host
+        cookies = None
         if 'pyreadcookies' in query:
             qs = request.rel_url.query_string
             cookie_str = qs[qs.find('pyreadcookies=') + 14:]
-            self.cookies = {}
-            cookies = cookie_str.split('; ')
-            for c in cookies:
+            cookies = {}
+            for c in cookie_str.split('; '):
                 k, v = c.split('=', 1)
-                self.cookies[k] = v
-        raise web.HTTPFound(location.path)
+                cookies[k] = v
+        context = self._context(request, create=True)
+        context.open(location, request.headers.get('User-Agent'), cookies)
+        response = web.Response(status=302, headers={
+            'Location': self.CONTEXT_PREFIX + context.key + location.path})
+        response.set_cookie(self.CONTEXT_COOKIE, context.key, httponly=True,
+                            samesite='Lax')
+        return response
 
     async def pyreadapi(self, request):
         if request.method == 'POST':
@@ -153,11 +490,19 @@ class AIOProxy:
             return web.Response(text=json.dumps((time.time() -
                                                  self.active_tab) <
                                                 self.ACTIVE_TIMEOUT))
+        if type == 'cache':
+            return web.Response(text=json.dumps(self.cache.stats()),
+                                content_type='application/json')
+        if type == 'pools':
+            return web.Response(text=json.dumps(
+                                    {**self.http.stats(),
+                                     'browsers': self.browsers.stats()}),
+                                content_type='application/json')
         if doi is None or type is None:
             raise web.HTTPBadRequest
         article = self.cache.get(doi)
         if article is None:
-            article = Article(self.session, self.cookies, self.headers)
+            article = self._new_article()
             self.cache[doi] = article
         entry = await article.a_init(doi=doi)
         if type == 'info':
@@ -169,45 +514,98 @@ class AIOProxy:
                                 content_type='application/json')
         if type == 'fileinfo':
             try:
-                return web.Response(text=json.dumps(await article.file_info()),
-                                    content_type='application/json')
+                info = await article.file_info()
             except FileNotFoundError:
                 raise web.HTTPNotFound
+            return self._cached_response(request, dumps(info),
+                                         'application/json')
         if type == 'file':
             name = data.get('name')
             if name is None:
                 raise web.HTTPBadRequest
-            ext = Path(name).suffix
-            content_type = self.FILE_EXTENSIONS[ext]
             try:
-                body = await article.get_file(name)
+                file = article.stored_file(name)
             except FileNotFoundError:
                 raise web.HTTPNotFound
-            return web.Response(body=body,
-                                content_type=content_type)
-        if type == 'content':
-            await article.load()
-            if not hasattr(article, 'content'):
+            return self._file_response(request, file.location,
+                                       self.FILE_EXTENSIONS.get(
+                                           Path(name).suffix))
+        if type in ['content', 'references']:
+            try:
+                payload = await article.payload(
+                    type, lambda obj: CompressedBody(dumps(obj)))
+            except FileNotFoundError:
                 raise web.HTTPNotFound
-            return web.Response(text=json.dumps(article.content),
-                                content_type='application/json')
+            self.cache.resize(doi)
+            return self._send(request, payload, 'application/json')
+
+    def _file_response(self, request, path, content_type=None,
+                       cache_control='no-cache'):
+        # Sent with sendfile by aiohttp, which also answers Range and
+        # conditional requests from the file's stat; its ETag is made of
+        # mtime and size, which do not change for a stored blob
+        headers = {'Cache-Control': cache_control}
+        if content_type is not None:
+            headers['Content-Type'] = content_type
+        return web.FileResponse(path, chunk_size=self.PROXY_CHUNK_SIZE,
+                                headers=headers)
+
+    def _send(self, request, payload, content_type,
+              cache_control='no-cache'):
+        # Sends the variant of a CompressedBody the client accepts. The
+        # ETag is the hash of the body, so a client revalidating an
+        # unchanged response gets a 304 instead of the body again
+        encoding, body = payload.variant(
+            request.headers.get('Accept-Encoding'))
+        etag = payload.tag
+        if encoding is not None:
+            etag = f'{etag}-{encoding}'
+        headers = {'ETag': f'"{etag}"', 'Cache-Control': cache_control,
+                   'Vary': 'Accept-Encoding'}
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            return web.Response(status=304, headers=headers)
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+        return web.Response(body=body, content_type=content_type,
+                            headers=headers)
+
+    def _cached_response(self, request, body, content_type,
+                         cache_control='no-cache'):
+        return self._send(request, CompressedBody(body), content_type,
+                          cache_control)
+
+    async def _add_file(self, article, context, source, **kwargs):
+        if context is not None:
+            kwargs['cookies'] = context.cookies_for(source)
+        try:
+            await article.add_file(source, **kwargs)
+        except FileExistsError:
+            pass
+        except self.FILE_ERRORS as e:
+            return repr(e)
+        return None
 
-        if type == 'references':
-            await article.load()
-            if not hasattr(article, 'references'):
-                raise web.HTTPNotFound
-            return web.Response(text=json.dumps(article.references),
-                                content_type='application/json')
+    async def _add_files(self, jobs):
+        # jobs: [(source, _add_file coroutine)] -> {source: error}
+        results = await asyncio.gather(*[job for _, job in jobs])
+        return {source: error for (source, _), error in zip(jobs, results)
+                if error is not None}
 
     async def pyreadscrapi(self, request):
         data = await request.json()
         doi = data.get('doi')
         if doi is None:
             raise web.HTTPBadRequest
+        # Scrapers run in proxied pages, so their files are fetched with
+        # the cookies of the reader that page belongs to
+        context = self._context(request)
         article = self.cache.get(doi)
         if article is None:
-            article = Article(self.session, self.cookies, self.headers)
+            article = self._new_article(context)
             self.cache[doi] = article
+        elif context is not None:
+            article.cookies = context.cookies
+            article.headers = context.headers
         entry = await article.a_init(doi=doi)
         if 'info' in data:
             status = await article.verify_integrity()
@@ -224,6 +622,7 @@ class AIOProxy:
                                                  'status': 'success'}),
                                 content_type='application/json')
         if 'figures' in data:
+            jobs = []
             for f in data['figures']:
                 for res in ['lr', 'hr']:
                     if res not in f:
@@ -240,16 +639,17 @@ class AIOProxy:
                         identity = ArticleItem.OTHER
                         number = 0
                     print(identity, number)
-                    try:
-                        await article.add_file(f[res], identity=identity,
-                                               number=number, title=f['title'],
-                                               caption=f.get('legend'),
-                                               low_res=(res == 'lr'))
-                    except FileExistsError:
-                        pass
-            return web.Response(text=json.dumps({'item': 'figures',
-                                                 'status': 'success'}),
-                                content_type='application/json')
+                    jobs.append((f[res], self._add_file(
+                        article, context, f[res], identity=identity,
+                        number=number, title=f['title'],
+                        caption=f.get('legend'), low_res=(res == 'lr'))))
+            errors = await self._add_files(jobs)
+            await article.flush()
+            self.cache.resize(doi)
+            return web.Response(text=json.dumps(
+                {'item': 'figures', 'errors': errors,
+                 'status': 'error' if errors else 'success'}),
+                content_type='application/json')
 
         if 'main' in data:
             article.add_content(data['main'])
@@ -258,9 +658,9 @@ class AIOProxy:
                                                  'status': 'success'}),
                                 content_type='application/json')
         if 'references' in data:
-            await asyncio.gather(*[article.add_reference(ref, num)
-                                   for num, ref in
-                                   enumerate(data['references'])])
+            await article.add_references(
+                data['references'],
+                progress=lambda done, total: print(f'REFS: {done}/{total}'))
             print("===============Refs Done==============")
             await article.save()
             return web.Response(text=json.dumps({'item': 'references',
@@ -268,6 +668,7 @@ class AIOProxy:
                                 content_type='application/json')
 
         if 'files' in data:
+            jobs = []
             for file, link in data['files'].items():
                 if file == 'pdf':
                     identity = ArticleItem.PDF
@@ -275,84 +676,112 @@ class AIOProxy:
                     identity = ArticleItem.EXTENDED_PDF
                 else:
                     identity = ArticleItem.OTHER
-                try:
-                    await article.add_file(link, identity=identity, title=file)
-                except FileExistsError:
-                    pass
-            return web.Response(text=json.dumps({'item': 'files',
-                                                 'status': 'success'}),
-                                content_type='application/json')
+                jobs.append((link, self._add_file(article, context, link,
+                                                  identity=identity,
+                                                  title=file)))
+            errors = await self._add_files(jobs)
+            await article.flush()
+            self.cache.resize(doi)
+            return web.Response(text=json.dumps(
+                {'item': 'files', 'errors': errors,
+                 'status': 'error' if errors else 'success'}),
+                content_type='application/json')
         raise web.HTTPBadRequest
 
     async def proxy(self, request):
-        async with self.session.get(self.netloc + str(request.rel_url),
-                                    headers=self.headers,
-                                    cookies=self.cookies,
-                                    ssl=sslcontext,
-                                    max_redirects=20) as response:
-            body = await response.content.read()
-            if response.content_type == 'text/html':
-                scraper = None
-                scraper = self._get_parser(body)
-                head_end = body.find(b'</head>')
-                if head_end != -1:
-                    if scraper is not None:
-                        scraper_str = b'<script type="text/javascript"'\
-                                      b' src="/pyreadasset?file=scrapers/' +\
-                                      scraper.encode('utf-8') + b'"></script>'
-                    else:
-                        scraper_str = b''
-                    body = body[:head_end] + scraper_str +\
-                        b'<script type="text/javascript"'\
-                        b' src="/pyreadasset?file=pyreadscrape.js"></script>'\
-                        + body[head_end:]
+        context = self._context(request)
+        if context is None or context.origin is None:
+            raise web.HTTPNotFound
+        key, path = self._split_path(request.rel_url.raw_path)
+        if key is None and self._is_navigation(request):
+            # Keep the tab's pages under its prefix, so that whatever they
+            # load next is found through Referer too
+            raise web.HTTPTemporaryRedirect(self.CONTEXT_PREFIX +
+                                            context.key +
+                                            str(request.rel_url))
+        if request.rel_url.raw_query_string:
+            path += '?' + request.rel_url.raw_query_string
+        headers = {**context.headers,
+                   'Accept-Encoding': self.PROXY_ACCEPT_ENCODING}
+        for h in self.PROXY_REQUEST_HEADERS:
+            if h in request.headers:
+                headers[h] = request.headers[h]
+        async with context.session.get(context.origin + path,
+                                       headers=headers, ssl=sslcontext,
+                                       max_redirects=20) as response:
+            if response.content_type != 'text/html':
+                stream = web.StreamResponse(
+                    status=response.status,
+                    headers={h: response.headers[h]
+                             for h in self.PROXY_RESPONSE_HEADERS
+                             if h in response.headers})
+                await stream.prepare(request)
+                async for chunk in response.content.iter_chunked(
+                        self.PROXY_CHUNK_SIZE):
+                    await stream.write(chunk)
+                await stream.write_eof()
+                return stream
+            body = self._decode(await response.content.read(),
+                                response.headers.get('Content-Encoding'))
+            head = PageHead(body)
+            scraper = self._get_parser(head)
+            head_end = head.end
+            if head_end != -1:
+                if scraper is not None:
+                    scraper_str = b'<script type="text/javascript"'\
+                                  b' src="' +\
+                                  self.asset_url('scrapers/' + scraper).\
+                                  encode('utf-8') + b'"></script>'
+                else:
+                    scraper_str = b''
+                body = body[:head_end] + scraper_str +\
+                    b'<script type="text/javascript"'\
+                    b' src="' +\
+                    self.asset_url('pyreadscrape.js').encode('utf-8') +\
+                    b'"></script>' + body[head_end:]
             return web.Response(body=body,
                                 status=response.status,
                                 content_type=response.content_type,
                                 charset=response.charset)
 
-    async def pyreadasset(self, request):
+    def asset_url(self, name):
+        tag = self.assets.tag(name)
+        if tag is None:
+            return f'/pyreadasset?file={name}'
+        return f'/pyreadasset?file={name}&v={tag}'
+
+    async def pyreadasset(self, request, name=None):
         query = request.rel_url.query
-        if 'file' not in query:
+        if name is None:
+            name = query.get('file')
+        if name is None:
             raise web.HTTPBadRequest
+        try:
+            asset = await self.assets.get(name)
+        except OSError:
+            raise web.HTTPNotFound
+        if query.get('v') == asset.tag:
+            cache_control = f'public, max-age={self.ASSET_MAX_AGE}, immutable'
         else:
-            suffix = Path(query['file']).suffix
-            content_type = self.FILE_EXTENSIONS.get(suffix)
-            try:
-                async with aiofiles.open('assets/' + query['file'], 'rb') as f:
-                    body = await f.read()
-                    return web.Response(body=body, content_type=content_type)
-            except FileNotFoundError:
-                raise web.HTTPNotFound
+            cache_control = 'no-cache'
+        return self._send(request, asset, asset.content_type, cache_control)
+
+    async def _resolve_in_browser(self, doi):
+        async with self.browsers.session() as session:
+            await session.get('https://dx.doi.org/' + doi)
+            return await arsenic.pyr_wait_for_url(
+                session, self.resolver.supported,
+                timeout=self.BROWSER_RESOLVE_TIMEOUT)
 
     async def pyreadresolve(self, request):
-        TIMEOUT = 20
         doi = request.query.get('doi')
         if doi is None:
             raise web.HTTPBadRequest
-        service = arsenic.PyrGeckodriver(
-            binary='C:\\webdrivers\\geckodriver.exe')
-        browser = arsenic.PyrFirefox(**{'moz:firefoxOptions':
-                                     {'args': ['-headless']}})
-        found = False
-        retry_num = 0
-        async with arsenic.pyr_get_session(service, browser) as session:
-            await session.get('https://dx.doi.org/' + doi)
-            while not found and retry_num < TIMEOUT:
-                current_url = await session.get_url()
-                print(current_url)
-                for c in CAPABILITIES:
-                    if current_url.find(c) != -1:
-                        found = True
-                        break
-                if found:
-                    break
-                retry_num += 1
-                await asyncio.sleep(0.5)
-        if found:
-            return web.Response(text=json.dumps({'url': current_url}),
-                                content_type='application/json')
-        raise web.HTTPNotFound
+        url = await self.resolver.resolve(doi)
+        if url is None:
+            raise web.HTTPNotFound
+        return web.Response(text=json.dumps({'url': url}),
+                            content_type='application/json')
 
     async def pyreadredirect(self, request):
         doi = request.query.get('doi')
@@ -360,16 +789,20 @@ class AIOProxy:
             raise web.HTTPNotFound
         article = self.cache.get(doi)
         if article is None:
-            article = Article(self.session, self.cookies, self.headers)
+            article = self._new_article()
             self.cache[doi] = article
         entry = await article.a_init(doi=doi)
         page = (b'<!DOCTYPE html>'
                 b'<html>'
                 b'<head>'
                 b'<link rel="stylesheet" '
-                b'href="/pyreadasset?file=pyreadredirect.css">'
+                b'href="' +
+                self.asset_url('pyreadredirect.css').encode('utf-8') +
+                b'">'
                 b'<script type="text/javascript" '
-                b'src="/pyreadasset?file=pyreadredirect.js"></script>'
+                b'src="' +
+                self.asset_url('pyreadredirect.js').encode('utf-8') +
+                b'"></script>'
                 b'<meta charset="UTF-8">'
                 b'</head>'
                 b'<body>'
@@ -401,7 +834,7 @@ class AIOProxy:
             print(loading)
             article = self.cache.get(doi)
             if article is None:
-                article = Article(self.session, self.cookies, self.headers)
+                article = self._new_article()
                 self.cache[doi] = article
             await article.a_init(doi=doi)
             if loading == 'true':
@@ -417,7 +850,6 @@ class AIOProxy:
                             content_type='application/json')
 
     async def handler(self, request):
-        Object = lambda **kwargs: type('Object', (), kwargs)
         path = request.rel_url.path
         if path.startswith('/pyreadproxy'):
             return await self.pyreadproxy(request)
@@ -436,16 +868,20 @@ class AIOProxy:
         elif path.startswith('/pyreadstatus'):
             return await self.pyreadstatus(request)
         elif path.startswith('/favicon.ico'):
-            request = Object(rel_url=Object(query={'file':
-                                                   'icons/favicon.ico'}))
-            return await self.pyreadasset(request)
+            return await self.pyreadasset(request, 'icons/favicon.ico')
         else:
             return await self.proxy(request)
 
 
 async def main():
     proxy = AIOProxy()
-    await proxy.create_session()
+    await asyncio.gather(proxy.create_session(), proxy.parser.start(),
+                         proxy.assets.load())
+    removed = await proxy.store.gc()
+    if removed > 0:
+        print(f'Removed {removed} unreferenced blobs')
+    verify_task = asyncio.ensure_future(proxy.verify_sweep())
+    warm_task = asyncio.ensure_future(proxy.browsers.warm())
     server = web.Server(proxy.handler)
     runner = web.ServerRunner(server)
     await runner.setup()
@@ -454,9 +890,49 @@ async def main():
 
     print("======= Serving on http://127.0.0.1:8080/ ======")
 
-    await asyncio.sleep(100*3600)
+    try:
+        await asyncio.sleep(100*3600)
+    finally:
+        verify_task.cancel()
+        warm_task.cancel()
+        await proxy.browsers.close()
+        proxy.contexts.expire()
+        await asyncio.gather(*[c.close() for c in proxy.contexts.values()])
+        await proxy.http.close()
+        await proxy.db.close()
+        proxy.parser.shutdown()
 
-try:
-    asyncio.run(main())
-except KeyboardInterrupt:
-    pass
+
+async def verify():
+    proxy = AIOProxy()
+    try:
+        report = await proxy.verify()
+    finally:
+        await proxy.db.close()
+    return len(report['changed']) + len(report['missing']) == 0
+
+
+async def migrate_store():
+    # Copies every article's JSON files into the metadata database; set
+    # PYREAD_ARTICLE_STORE=sqlite afterwards to use them
+    db = MetaDB.shared()
+    try:
+        count = await migrate_sections(JsonSectionStore(),
+                                       SqliteSectionStore(db))
+    finally:
+        await db.close()
+    print(f'Migrated {count} articles')
+
+
+# Only started when run as a script, so that importing this module (e.g.
+# from the tests) does not start a server
+if __name__ == '__main__':
+    if sys.argv[1:] == ['verify']:
+        sys.exit(0 if asyncio.run(verify()) else 1)
+    if sys.argv[1:] == ['migrate-store']:
+        asyncio.run(migrate_store())
+        sys.exit(0)
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
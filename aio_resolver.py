@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+import asyncio
+import aiohttp
+from yarl import URL
+from aio_throttle import SingleFlight
+
+
+class DoiResolver:
+
+    # Finds the publisher page a DOI lands on. Following the doi.org
+    # redirects with a plain request is enough for most publishers; only
+    # when that ends somewhere else (usually a page that redirects with
+    # JavaScript) is browser_resolve(doi) tried. Results are kept in the
+    # doi_urls table, DOIs that could not be resolved with a NULL url.
+
+    DOI_URL = 'https://doi.org/'
+    MAX_REDIRECTS = 20
+    # Landing pages move now and then, so old entries are checked again;
+    # failures are often temporary and retried much sooner
+    MAX_AGE = timedelta(days=30)
+    FAILED_MAX_AGE = timedelta(minutes=10)
+
+    def __init__(self, session, db, capabilities, browser_resolve=None,
+                 headers=None, ssl=None):
+        self.session = session
+        self.ssl = ssl
+        self.db = db
+        self.capabilities = capabilities
+        self.browser_resolve = browser_resolve
+        self.headers = headers
+        self._calls = SingleFlight()
+
+    def supported(self, url):
+        host = URL(url).host or ''
+        return any(host == c or host.endswith('.' + c)
+                   for c in self.capabilities)
+
+    async def cached(self, doi):
+        # (True, url) while the entry is fresh, with url None if the DOI
+        # could not be resolved; (False, None) when it has to be resolved
+        rows = await self.db.fetchall('SELECT url, resolved FROM doi_urls '
+                                      'WHERE doi = ?', (doi.lower(),))
+        if len(rows) == 0:
+            return False, None
+        url, resolved = rows[0]
+        max_age = self.MAX_AGE if url is not None else self.FAILED_MAX_AGE
+        if datetime.now() - datetime.fromisoformat(resolved) > max_age:
+            return False, None
+        return True, url
+
+    async def remember(self, doi, url):
+        await self.db.execute('INSERT INTO doi_urls VALUES (?, ?, ?) '
+                              'ON CONFLICT(doi) DO UPDATE SET '
+                              'url = excluded.url, '
+                              'resolved = excluded.resolved',
+                              (doi.lower(), url, datetime.now().isoformat()))
+
+    async def follow(self, doi):
+        # The body is never read, only where the redirects end up
+        try:
+            async with self.session.get(self.DOI_URL + doi,
+                                        headers=self.headers, ssl=self.ssl,
+                                        max_redirects=self.MAX_REDIRECTS
+                                        ) as response:
+                return str(response.url)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f'{doi}: {e!r}')
+            return None
+
+    async def resolve(self, doi):
+        return await self._calls.do(doi.lower(),
+                                    lambda: self._resolve(doi))
+
+    async def _resolve(self, doi):
+        found, url = await self.cached(doi)
+        if found:
+            return url
+        url = await self.follow(doi)
+        if (url is None or not self.supported(url)) and \
+                self.browser_resolve is not None:
+            print(f'{doi}: {url} needs a browser')
+            url = await self.browse(doi)
+        if url is not None and not self.supported(url):
+            url = None
+        await self.remember(doi, url)
+        return url
+
+    async def browse(self, doi):
+        # Whatever goes wrong in the browser (a dead session, a page that
+        # never settles) just means the DOI could not be resolved
+        try:
+            return await self.browser_resolve(doi)
+        except Exception as e:
+            print(f'{doi}: browser failed: {e!r}')
+            return None
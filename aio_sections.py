@@ -0,0 +1,125 @@
+from pathlib import Path
+import asyncio
+import json
+import os
+import secrets
+import aiofiles
+
+
+SECTIONS = ['manifest', 'content', 'references', 'figures']
+
+
+class JsonSectionStore:
+
+    # The original layout: one <section>.json file per section in the
+    # article's directory
+
+    def _path(self, path, section):
+        return Path(path, section + '.json')
+
+    async def read(self, path, section):
+        file_path = self._path(path, section)
+        if not file_path.exists():
+            return None
+        async with aiofiles.open(str(file_path), 'r', encoding='utf-8') as f:
+            return json.loads(await f.read())
+
+    async def write(self, path, section, obj):
+        # Written next to the target and renamed over it, so readers
+        # never see a partial file
+        file_path = self._path(path, section)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = file_path.with_name(
+            f'{file_path.name}.{secrets.token_hex(4)}.tmp')
+        async with aiofiles.open(str(tmp_path), 'w', encoding='utf-8') as f:
+            await f.write(json.dumps(obj))
+        os.replace(tmp_path, file_path)
+
+    async def exists(self, path, section):
+        return self._path(path, section).exists()
+
+    async def signature(self, path, sections):
+        # The size too, since a rewrite can land within the resolution of
+        # the file system's timestamps
+        signature = []
+        for section in sections:
+            try:
+                stat = self._path(path, section).stat()
+            except FileNotFoundError:
+                signature.append(None)
+            else:
+                signature.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    async def paths(self, root='files'):
+        manifests = await asyncio.to_thread(
+            lambda: list(Path(root).rglob('manifest.json')))
+        return [m.parent for m in manifests]
+
+
+class SqliteSectionStore:
+
+    # Every section of every article as a row of the article_sections
+    # table in the metadata database, so opening an article for one
+    # section is a single indexed read
+
+    def __init__(self, db):
+        self.db = db
+
+    def _key(self, path):
+        return Path(path).as_posix()
+
+    async def read(self, path, section):
+        rows = await self.db.fetchall('SELECT data FROM article_sections '
+                                      'WHERE article = ? AND section = ?',
+                                      (self._key(path), section))
+        if len(rows) == 0:
+            return None
+        return json.loads(rows[0][0])
+
+    async def write(self, path, section, obj):
+        await self.db.execute('INSERT INTO article_sections '
+                              'VALUES (?, ?, ?, 1) '
+                              'ON CONFLICT(article, section) DO UPDATE SET '
+                              'data = excluded.data, version = version + 1',
+                              (self._key(path), section, json.dumps(obj)))
+
+    async def exists(self, path, section):
+        rows = await self.db.fetchall('SELECT 1 FROM article_sections '
+                                      'WHERE article = ? AND section = ?',
+                                      (self._key(path), section))
+        return len(rows) > 0
+
+    async def signature(self, path, sections):
+        rows = await self.db.fetchall('SELECT section, version '
+                                      'FROM article_sections '
+                                      'WHERE article = ?', (self._key(path),))
+        versions = dict(rows)
+        return tuple(versions.get(s) for s in sections)
+
+    async def paths(self, root='files'):
+        rows = await self.db.fetchall('SELECT DISTINCT article '
+                                      'FROM article_sections '
+                                      'WHERE section = ?', ('manifest',))
+        root = Path(root).as_posix()
+        return [Path(a) for (a,) in rows
+                if a == root or a.startswith(root + '/')]
+
+
+def section_store(kind, db):
+    if kind == 'json':
+        return JsonSectionStore()
+    if kind == 'sqlite':
+        return SqliteSectionStore(db)
+    raise ValueError(f'Unknown article store {kind!r}')
+
+
+async def migrate_sections(source, target, root='files'):
+    paths = await source.paths(root)
+    for path in paths:
+        for section in SECTIONS:
+            obj = await source.read(path, section)
+            if obj is not None:
+                await target.write(path, section, obj)
+        print(f'Migrated {path}')
+    return len(paths)
@@ -0,0 +1,91 @@
+import asyncio
+import contextlib
+import random
+import time
+from yarl import URL
+
+
+def backoff(attempt, base=0.5, cap=30):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class SingleFlight:
+
+    # Concurrent calls with the same key await the same future instead of
+    # repeating the work.
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._forget(key, f))
+        # Shielded so that one caller giving up does not cancel the others
+        return await asyncio.shield(future)
+
+    def _forget(self, key, future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        if burst is None:
+            burst = max(1, rate)
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens +
+                                   (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class HostLimiter:
+
+    # host: (requests per second, concurrent requests). NCBI allows three
+    # requests per second without an API key and ten with one.
+    LIMITS = {'pubmed.ncbi.nlm.nih.gov': (3, 3),
+              'eutils.ncbi.nlm.nih.gov': (3, 3),
+              'dx.doi.org': (10, 10),
+              'api.crossref.org': (10, 10)}
+    DEFAULT_LIMIT = (None, 10)
+
+    def __init__(self, limits=None, default=None):
+        self.limits = {**self.LIMITS}
+        if limits is not None:
+            self.limits.update(limits)
+        if default is None:
+            default = self.DEFAULT_LIMIT
+        self.default = default
+        self._hosts = {}
+
+    def _for_host(self, host):
+        if host not in self._hosts:
+            rate, concurrency = self.limits.get(host, self.default)
+            bucket = TokenBucket(rate) if rate is not None else None
+            self._hosts[host] = (asyncio.Semaphore(concurrency), bucket)
+        return self._hosts[host]
+
+    @contextlib.asynccontextmanager
+    async def request(self, url):
+        semaphore, bucket = self._for_host(URL(url).host)
+        async with semaphore:
+            if bucket is not None:
+                await bucket.acquire()
+            yield
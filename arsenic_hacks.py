@@ -2,8 +2,10 @@ import arsenic
 from arsenic.errors import SessionStartError
 import abc
 from functools import partial
+import contextlib
 import asyncio
 import re
+import time
 import attr
 import sys
 from distutils.version import StrictVersion
@@ -143,6 +145,169 @@ async def pyr_start_session(service, browser, bind=""):
     return await driver.new_session(browser, bind=bind)
 
 
+async def pyr_stop_session(session):
+    try:
+        await session.close()
+    finally:
+        await session.driver.close()
+
+
+# Returns as soon as the page is being left or its URL differs from the
+# one passed in, or after the given number of ms; navigating away aborts
+# the script, which the caller treats the same way
+_WAIT_FOR_NAVIGATION = """
+var seen = arguments[0];
+var done = arguments[arguments.length - 1];
+if (window.location.href !== seen) {
+  done(window.location.href);
+  return;
+}
+window.addEventListener("pagehide", function() { done(null); });
+window.addEventListener("hashchange", function() { done(null); });
+setTimeout(function() { done(null); }, arguments[1]);
+"""
+
+
+def _navigated(error):
+    # What geckodriver and chromedriver report when the page an async
+    # script runs in is unloaded
+    return (isinstance(error, arsenic.errors.WebdriverError) and
+            "unloaded" in str(error.message).lower())
+
+
+async def pyr_wait_for_url(session, predicate, timeout=10, wake=5,
+                           retry=0.5):
+    # Waits until predicate(url) holds for the session's URL and returns
+    # it, or returns None after timeout s. Instead of polling, an injected
+    # script sleeps in the page until it navigates; wake bounds that
+    # sleep for changes no event reports (e.g. history.pushState). Other
+    # script errors are retried after retry s.
+    deadline = time.monotonic() + timeout
+    while True:
+        url = await session.get_url()
+        if predicate(url):
+            return url
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        try:
+            await asyncio.wait_for(
+                session.execute_async_script(
+                    _WAIT_FOR_NAVIGATION, url,
+                    int(min(remaining, wake) * 1000)),
+                remaining + 1)
+        except asyncio.TimeoutError:
+            return None
+        except arsenic.errors.ScriptTimeout:
+            # The session's script timeout is shorter than wake
+            pass
+        except arsenic.errors.ArsenicError as e:
+            if not _navigated(e):
+                print(f"Waiting for navigation: {e!r}")
+                await asyncio.sleep(min(retry, remaining))
+
+
+class PyrBrowserPool:
+
+    # Keeps up to size browser sessions alive between uses. A session is
+    # checked before it is handed out, dropped if a caller fails with it
+    # and replaced after max_uses. start() -> session and stop(session)
+    # default to geckodriver/Firefox but can be anything with the same
+    # get/get_url calls, e.g. a stub in tests.
+
+    SIZE = 2
+    MAX_USES = 25
+    HEALTH_TIMEOUT = 5
+    BLANK_URL = "about:blank"
+
+    def __init__(self, start, stop=None, size=None, max_uses=None):
+        self._start = start
+        if stop is None:
+            stop = pyr_stop_session
+        self._stop = stop
+        self.size = size or self.SIZE
+        self.max_uses = max_uses or self.MAX_USES
+        # [session, uses] of the sessions not in use
+        self._idle = []
+        self._slots = asyncio.Semaphore(self.size)
+        self.started = 0
+        self.recycled = 0
+        self.failed = 0
+
+    async def _new(self):
+        session = await self._start()
+        self.started += 1
+        return [session, 0]
+
+    async def _discard(self, session):
+        try:
+            await self._stop(session)
+        except Exception as e:
+            print(f"Closing browser session: {e!r}")
+
+    async def _healthy(self, session):
+        try:
+            await asyncio.wait_for(session.get_url(), self.HEALTH_TIMEOUT)
+        except Exception:
+            return False
+        return True
+
+    async def _checkout(self):
+        while len(self._idle) > 0:
+            entry = self._idle.pop()
+            if await self._healthy(entry[0]):
+                return entry
+            self.failed += 1
+            await self._discard(entry[0])
+        return await self._new()
+
+    async def _checkin(self, entry):
+        entry[1] += 1
+        if entry[1] >= self.max_uses:
+            self.recycled += 1
+            await self._discard(entry[0])
+            return
+        try:
+            # So the last page stops running while the session waits
+            await entry[0].get(self.BLANK_URL)
+        except Exception:
+            self.failed += 1
+            await self._discard(entry[0])
+            return
+        self._idle.append(entry)
+
+    async def warm(self):
+        missing = self.size - len(self._idle)
+        for result in await asyncio.gather(
+                *[self._new() for _ in range(missing)],
+                return_exceptions=True):
+            if isinstance(result, Exception):
+                print(f"Starting browser session: {result!r}")
+            else:
+                self._idle.append(result)
+
+    @contextlib.asynccontextmanager
+    async def session(self):
+        async with self._slots:
+            entry = await self._checkout()
+            try:
+                yield entry[0]
+            except BaseException:
+                self.failed += 1
+                await self._discard(entry[0])
+                raise
+            await self._checkin(entry)
+
+    def stats(self):
+        return {"size": self.size, "idle": len(self._idle),
+                "max_uses": self.max_uses, "started": self.started,
+                "recycled": self.recycled, "failed": self.failed}
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*[self._discard(s) for s, _ in idle])
+
+
 class PyrSessionContext(arsenic.SessionContext):
 
     async def __aenter__(self):
@@ -398,10 +398,10 @@ function load_page(idx = -1) {
   var sidebar = document.getElementsByClassName("sidenav-linkcon");
   if (current_article != -1 && sessions[current_article].doi != null) {
     sidebar[current_article].classList.add("active");
-    get_content.open("POST", "pyreadapi");
-    var params = JSON.stringify({"doi": sessions[current_article].doi,
-                                 "type": "content"});
-    get_content.send(params);
+    // GET so that the browser can revalidate with the ETag
+    get_content.open("GET", "pyreadapi?type=content&doi=" +
+                     encodeURIComponent(sessions[current_article].doi));
+    get_content.send();
   } else {
     save_session();
   }
@@ -448,9 +448,9 @@ get_content.onload = function () {
     }
     article.appendChild(section);
   }
-  var params = JSON.stringify({"doi": sessions[current_article].doi, "type": "references"});
-  get_refs.open("POST", "pyreadapi");
-  get_refs.send(params);
+  get_refs.open("GET", "pyreadapi?type=references&doi=" +
+                encodeURIComponent(sessions[current_article].doi));
+  get_refs.send();
 };
 
 get_refs.onload = function () {
@@ -498,9 +498,9 @@ get_refs.onload = function () {
     references = response_data;
   }
   article.appendChild(refs);
-  var params = JSON.stringify({"doi": sessions[current_article].doi, "type": "fileinfo"});
-  get_fileinfo.open("POST", "pyreadapi");
-  get_fileinfo.send(params);
+  get_fileinfo.open("GET", "pyreadapi?type=fileinfo&doi=" +
+                    encodeURIComponent(sessions[current_article].doi));
+  get_fileinfo.send();
 };
 
 get_fileinfo.onload = function() {
@@ -0,0 +1,55 @@
+import asyncio
+import pytest
+import pytest_asyncio
+import aio_articleparser as ap
+from aio_metadb import MetaDB
+from aio_blobstore import BlobStore
+from aio_sections import JsonSectionStore
+
+pytestmark = [pytest.mark.asyncio]
+
+
+@pytest_asyncio.fixture
+async def article(tmp_path):
+    db = MetaDB(str(tmp_path.joinpath('meta.db')))
+    article = ap.Article(None, {}, {}, db=db,
+                         store=BlobStore(db, tmp_path.joinpath('blobs')),
+                         sections=JsonSectionStore())
+    article.path = tmp_path.joinpath('article')
+    article.path.mkdir()
+    article.files = {}
+    article.manifest = {'files': {}}
+
+    async def check_local():
+        pass
+    article.check_local = check_local
+    article._schedule_flush = lambda: None
+    yield article
+    await db.close()
+
+
+def _slow_fetch(article):
+    async def fetch_file(source, date=None, cookies=None):
+        await asyncio.sleep(0.01)
+        return ap.ArticleFile(data=source.encode(), path=article.path,
+                              manifest={'name': 'fig1.jpg',
+                                        'source': [source], 'date': date},
+                              store=article.store)
+    return fetch_file
+
+
+async def test_same_name_from_two_sources_is_refused(article):
+    # Both downloads finish before either is added
+    article.fetch_file = _slow_fetch(article)
+    results = await asyncio.gather(
+        *[article.add_file(f'https://x.org/{res}/fig1.jpg',
+                           identity=ap.ArticleItem.FIGURE, number=1,
+                           title='Figure 1', low_res=(res == 'lr'))
+          for res in ('lr', 'hr')], return_exceptions=True)
+    assert results[0] is None
+    assert isinstance(results[1], FileExistsError)
+    kept = article.files['fig1.jpg']
+    assert kept.source == ['https://x.org/lr/fig1.jpg']
+    rows = await article.db.fetchall('SELECT refs FROM blobs WHERE hash = ?',
+                                     (kept.blob,))
+    assert rows == [(1,)]
@@ -0,0 +1,71 @@
+import os
+import json
+import time
+import hashlib
+import pytest
+import aio_articleparser as ap
+
+pytestmark = [pytest.mark.asyncio]
+
+DATA = b'%PDF-1.4 test file'
+DIGEST = int.from_bytes(hashlib.sha256(DATA).digest(), 'big')
+
+
+def _library(tmp_path, stored_hash, **extra):
+    article = tmp_path.joinpath('files', 'a')
+    article.mkdir(parents=True)
+    article.joinpath('f.pdf').write_bytes(DATA)
+    entry = {'name': 'f.pdf', 'source': ['https://example.org/f.pdf'],
+             'date': '2020-01-01T00:00:00', 'ftype': 1,
+             'hash': stored_hash, **extra}
+    article.joinpath('manifest.json').write_text(
+        json.dumps({'files': {'f.pdf': entry}}))
+    return article
+
+
+def _entry(article):
+    manifest = json.loads(article.joinpath('manifest.json').read_text())
+    return manifest['files']['f.pdf']
+
+
+async def test_legacy_hash_is_accepted_and_upgraded(tmp_path):
+    article = _library(tmp_path, hash(DIGEST))
+    report = await ap.verify_library(str(tmp_path.joinpath('files')))
+    assert report['changed'] == [] and report['missing'] == []
+    entry = _entry(article)
+    assert entry['hash'] == f'{DIGEST:064x}'
+    assert entry['size'] == len(DATA)
+
+
+async def test_touch_is_not_a_change(tmp_path):
+    article = _library(tmp_path, f'{DIGEST:064x}')
+    await ap.verify_library(str(tmp_path.joinpath('files')))
+    later = time.time() + 10
+    os.utime(article.joinpath('f.pdf'), (later, later))
+    report = await ap.verify_library(str(tmp_path.joinpath('files')))
+    assert report['changed'] == []
+    assert _entry(article)['mtime'] == article.joinpath(
+        'f.pdf').stat().st_mtime_ns
+
+
+async def test_modified_file_is_reported(tmp_path):
+    article = _library(tmp_path, f'{DIGEST:064x}')
+    article.joinpath('f.pdf').write_bytes(b'something else')
+    report = await ap.verify_library(str(tmp_path.joinpath('files')))
+    assert report['changed'] == [str(article.joinpath('f.pdf'))]
+
+
+async def test_verify_from_manifest_with_legacy_hash(tmp_path):
+    article = _library(tmp_path, hash(DIGEST))
+    file = ap.ArticleFile(article)
+    await file.verify_from_manifest(_entry(article))
+    assert file.fhash == DIGEST and not file.legacy_hash
+
+
+async def test_equality_against_legacy_entry(tmp_path):
+    article = _library(tmp_path, hash(DIGEST))
+    stored = ap.ArticleFile(article, manifest=_entry(article))
+    fetched = ap.ArticleFile(article, data=DATA,
+                             manifest={'name': 'f.pdf', 'source': [],
+                                       'date': '2020-01-01T00:00:00'})
+    assert stored == fetched
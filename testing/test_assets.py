@@ -0,0 +1,68 @@
+import gzip
+import pytest
+from aio_assets import CompressedBody, AssetCache, accepted_encodings
+
+BODY = b'<html>' + b'compressible text ' * 100 + b'</html>'
+
+
+def test_accepted_encodings():
+    assert accepted_encodings('gzip, br;q=0.5, deflate;q=0') == \
+        {'gzip', 'br'}
+    assert 'gzip' not in accepted_encodings(None)
+
+
+def test_small_and_incompressible_bodies_are_sent_as_is():
+    assert CompressedBody(b'tiny').variant('gzip, br') == (None, b'tiny')
+    payload = CompressedBody(BODY, compressible=False)
+    assert payload.variant('gzip') == (None, BODY)
+
+
+def test_gzip_variant_is_made_once():
+    payload = CompressedBody(BODY)
+    first = payload.variant('gzip')[1]
+    assert payload.variant('gzip')[1] is first
+    assert payload.size == len(BODY) + len(first)
+
+
+def test_tag_follows_body():
+    assert CompressedBody(BODY).tag == CompressedBody(BODY).tag
+    assert CompressedBody(BODY).tag != CompressedBody(BODY + b' ').tag
+
+
+@pytest.mark.asyncio
+async def test_variants_follow_accept_encoding(tmp_path):
+    tmp_path.joinpath('index.html').write_bytes(BODY)
+    tmp_path.joinpath('tiny.js').write_bytes(b'a')
+    tmp_path.joinpath('image.png').write_bytes(BODY)
+    cache = AssetCache(tmp_path)
+    assert await cache.load() == 3
+    asset = await cache.get('index.html')
+    encoding, body = asset.variant('gzip')
+    assert encoding == 'gzip' and gzip.decompress(body) == BODY
+    assert asset.variant('identity') == (None, BODY)
+    assert (await cache.get('tiny.js')).variant('gzip') == (None, b'a')
+    assert (await cache.get('image.png')).variant('gzip') == (None, BODY)
+
+
+@pytest.mark.asyncio
+async def test_asset_cache_reloads_changed_files(tmp_path):
+    tmp_path.joinpath('app.js').write_text('let a = 1;')
+    cache = AssetCache(tmp_path)
+    cache.RELOAD_INTERVAL = 0
+    assert await cache.load() == 1
+    first = await cache.get('app.js')
+    assert first.content_type == 'text/javascript'
+    tmp_path.joinpath('app.js').write_text('let a = 22;')
+    second = await cache.get('app.js')
+    assert second.body == b'let a = 22;' and second.tag != first.tag
+
+
+@pytest.mark.asyncio
+async def test_names_outside_the_root_are_not_found(tmp_path):
+    root = tmp_path.joinpath('assets')
+    root.mkdir()
+    tmp_path.joinpath('secret.txt').write_text('secret')
+    cache = AssetCache(root)
+    with pytest.raises(FileNotFoundError):
+        await cache.get('../secret.txt')
+    assert cache.tag('missing.js') is None
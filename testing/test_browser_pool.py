@@ -0,0 +1,151 @@
+import asyncio
+import pytest
+import arsenic
+from arsenic_hacks import PyrBrowserPool, pyr_wait_for_url
+
+pytestmark = [pytest.mark.asyncio]
+
+
+class FakeSession:
+
+    # Stands in for an arsenic session: get() loads a URL, get_url()
+    # reports it, and either fails once the "browser" has died
+
+    def __init__(self, number):
+        self.number = number
+        self.url = 'about:blank'
+        self.dead = False
+        self.stopped = False
+
+    async def get(self, url):
+        if self.dead:
+            raise ConnectionError('browser is gone')
+        self.url = url
+
+    async def get_url(self):
+        if self.dead:
+            raise ConnectionError('browser is gone')
+        return self.url
+
+
+class FakeDriver:
+
+    def __init__(self):
+        self.sessions = []
+
+    async def start(self):
+        session = FakeSession(len(self.sessions))
+        self.sessions.append(session)
+        return session
+
+    async def stop(self, session):
+        session.stopped = True
+
+
+@pytest.fixture
+def driver():
+    return FakeDriver()
+
+
+async def test_sessions_are_reused(driver):
+    pool = PyrBrowserPool(driver.start, driver.stop, size=2)
+    for _ in range(3):
+        async with pool.session() as session:
+            await session.get('https://example.org/')
+    assert len(driver.sessions) == 1
+    # Left on a blank page while idle
+    assert driver.sessions[0].url == PyrBrowserPool.BLANK_URL
+    assert pool.stats()['idle'] == 1
+
+
+async def test_warm_starts_size_sessions(driver):
+    pool = PyrBrowserPool(driver.start, driver.stop, size=2)
+    await pool.warm()
+    assert pool.stats()['idle'] == 2 and pool.started == 2
+
+
+async def test_at_most_size_sessions_at_once(driver):
+    pool = PyrBrowserPool(driver.start, driver.stop, size=2)
+    active = 0
+    peak = 0
+
+    async def use():
+        nonlocal active, peak
+        async with pool.session():
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+    await asyncio.gather(*[use() for _ in range(6)])
+    assert peak == 2 and len(driver.sessions) == 2
+
+
+async def test_session_is_recycled_after_max_uses(driver):
+    pool = PyrBrowserPool(driver.start, driver.stop, size=1, max_uses=2)
+    for _ in range(3):
+        async with pool.session():
+            pass
+    assert len(driver.sessions) == 2
+    assert driver.sessions[0].stopped and pool.recycled == 1
+
+
+async def test_dead_idle_session_is_replaced(driver):
+    pool = PyrBrowserPool(driver.start, driver.stop, size=1)
+    await pool.warm()
+    driver.sessions[0].dead = True
+    async with pool.session() as session:
+        assert session is driver.sessions[1]
+    assert driver.sessions[0].stopped and pool.failed == 1
+
+
+async def test_session_is_dropped_when_caller_fails(driver):
+    pool = PyrBrowserPool(driver.start, driver.stop, size=1)
+    with pytest.raises(ValueError):
+        async with pool.session():
+            raise ValueError
+    assert driver.sessions[0].stopped
+    assert pool.stats()['idle'] == 0
+
+
+async def test_close_stops_idle_sessions(driver):
+    pool = PyrBrowserPool(driver.start, driver.stop, size=2)
+    await pool.warm()
+    await pool.close()
+    assert all(s.stopped for s in driver.sessions)
+
+
+class ScriptSession(FakeSession):
+
+    # execute_async_script fails with error, after moving to next_url
+
+    def __init__(self, error, next_url=None):
+        super().__init__(0)
+        self.error = error
+        self.next_url = next_url
+        self.scripts = 0
+
+    async def execute_async_script(self, script, *args):
+        self.scripts += 1
+        if self.next_url is not None:
+            self.url = self.next_url
+        raise self.error
+
+
+async def test_wait_for_url_wakes_on_navigation():
+    error = arsenic.errors.JavascriptError('Document was unloaded', None,
+                                           None)
+    session = ScriptSession(error, next_url='https://example.org/article')
+    url = await pyr_wait_for_url(session, lambda u: 'article' in u,
+                                 timeout=1)
+    assert url == 'https://example.org/article'
+    assert session.scripts == 1
+
+
+async def test_wait_for_url_backs_off_on_other_errors():
+    error = arsenic.errors.UnknownError('Something broke', None, None)
+    session = ScriptSession(error)
+    url = await pyr_wait_for_url(session, lambda u: 'article' in u,
+                                 timeout=0.3, retry=0.1)
+    assert url is None
+    assert session.scripts <= 4
@@ -0,0 +1,97 @@
+import time
+from aio_proxy import PyrCache
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_recently_used_is_evicted():
+    evicted = []
+    cache = PyrCache(2, on_evict=lambda k, v: evicted.append(k))
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache['a'] == 1
+    cache['c'] = 3
+    assert evicted == ['b']
+    assert list(cache) == ['a', 'c']
+    assert cache.stats()['evictions'] == 1
+
+
+def test_byte_budget():
+    cache = PyrCache(10, max_bytes=10, sizeof=len)
+    cache['a'] = b'x' * 4
+    cache['b'] = b'x' * 4
+    cache['c'] = b'x' * 4
+    assert list(cache) == ['b', 'c'] and cache.nbytes == 8
+    # The most recent entry is kept even when it is over budget alone
+    cache['d'] = b'x' * 20
+    assert list(cache) == ['d'] and cache.nbytes == 20
+
+
+def test_resize_measures_grown_values():
+    cache = PyrCache(10, max_bytes=10, sizeof=len)
+    cache['a'] = []
+    cache['b'] = []
+    cache['a'].extend(range(8))
+    cache['b'].extend(range(8))
+    cache.resize('b')
+    assert cache.nbytes == 8
+    cache.resize('a')
+    assert list(cache) == ['a'] and cache.nbytes == 8
+
+
+def test_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, 'monotonic', clock)
+    evicted = []
+    cache = PyrCache(10, ttl=60, on_evict=lambda k, v: evicted.append(k))
+    cache['a'] = 1
+    cache.set('b', 2, ttl=120)
+    clock.now += 90
+    assert 'a' not in cache and 'b' in cache
+    assert cache.get('a') is None
+    assert evicted == ['a']
+    clock.now += 60
+    cache.expire()
+    assert len(cache) == 0 and evicted == ['a', 'b']
+    assert cache.stats()['expirations'] == 2
+
+
+def test_expired_entries_are_not_counted(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, 'monotonic', clock)
+    cache = PyrCache(10, ttl=60, sizeof=len)
+    cache['a'] = 'xxxx'
+    cache.set('b', 'yy', ttl=120)
+    clock.now += 90
+    assert len(cache) == 1 and list(cache) == ['b']
+    assert cache.nbytes == 2
+    clock.now += 60
+    stats = cache.stats()
+    assert stats['size'] == 0 and stats['bytes'] == 0
+    assert stats['expirations'] == 2
+
+
+def test_setting_again_pushes_back_expiry(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, 'monotonic', clock)
+    cache = PyrCache(10, ttl=60)
+    cache['a'] = 1
+    clock.now += 50
+    cache['a'] = cache['a']
+    clock.now += 50
+    assert cache['a'] == 1
+
+
+def test_hits_and_misses():
+    cache = PyrCache(10)
+    cache['a'] = 1
+    cache.get('a')
+    cache.get('b')
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -0,0 +1,58 @@
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from aio_proxy import AIOProxy, etag_matches
+
+pytestmark = [pytest.mark.asyncio]
+
+BODY = b'{"content": [' + b'"compressible text", ' * 10000 + b'""]}'
+
+
+@pytest_asyncio.fixture
+async def client():
+    proxy = AIOProxy.__new__(AIOProxy)
+
+    async def handle(request):
+        return proxy._cached_response(request, BODY, 'application/json')
+
+    app = web.Application()
+    app.router.add_get('/api', handle)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    yield client
+    await client.close()
+
+
+async def test_etag_matches():
+    assert etag_matches('"a", W/"b"', 'b')
+    assert etag_matches('*', 'a')
+    assert not etag_matches('"ab"', 'a')
+    assert not etag_matches(None, 'a')
+
+
+async def test_revalidation_with_the_sent_etag(client):
+    response = await client.get('/api')
+    assert response.status == 200
+    assert await response.read() == BODY
+    assert response.headers['Cache-Control'] == 'no-cache'
+    etag = response.headers['ETag']
+    response = await client.get('/api', headers={'If-None-Match': etag})
+    assert response.status == 304
+    assert response.headers['ETag'] == etag
+    response = await client.get('/api',
+                                headers={'If-None-Match': '"stale"'})
+    assert response.status == 200
+    assert await response.read() == BODY
+
+
+async def test_large_bodies_are_sent_compressed(client):
+    response = await client.get('/api', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert int(response.headers['Content-Length']) < len(BODY) // 10
+    assert await response.read() == BODY
+    response = await client.get('/api',
+                                headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    assert await response.read() == BODY
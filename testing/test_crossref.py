@@ -0,0 +1,37 @@
+from aio_crossref import parse_works, Crossref
+from aio_http import RequestError
+import json
+import pytest
+
+
+def test_parse_works():
+    body = json.dumps({'message': {'items': [
+        {'DOI': '10.1000/ABC', 'title': ['A  study\nof things'],
+         'container-title': ['Journal of Tests'],
+         'author': [{'given': 'Ann', 'family': 'Smith'},
+                    {'family': 'Jones'}, {'name': 'The Test Group'}],
+         'created': {'date-time': '2019-03-07T10:11:12Z'}},
+        {'title': ['No DOI']}]}})
+    assert parse_works(body) == {'10.1000/abc': {
+        'doi': '10.1000/ABC', 'title': 'A study of things',
+        'authors': ['Ann Smith', 'Jones', 'The Test Group'],
+        'journal': 'Journal of Tests', 'date': '2019-03-07T10:11:12'}}
+
+
+@pytest.mark.asyncio
+async def test_clients_parse_on_the_shared_pool_by_default():
+    async def get(url, params=None):
+        return json.dumps({'message': {'items': [{'DOI': '10.1/A'}]}})
+
+    assert list(await Crossref(get).fetch(['10.1/a'])) == ['10.1/a']
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('body', [b'{"error": "API key invalid"}',
+                                  b'<html>Service unavailable<br></html>'])
+async def test_error_bodies_are_request_errors(body):
+    async def get(url, params=None):
+        return body
+
+    with pytest.raises(RequestError):
+        await Crossref(get).fetch(['10.1/a'])
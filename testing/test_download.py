@@ -0,0 +1,110 @@
+import hashlib
+import aiohttp
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from aio_download import Downloader
+from aio_metadb import MetaDB
+from aio_blobstore import BlobStore
+
+pytestmark = [pytest.mark.asyncio]
+
+BODY = bytes(range(256)) * 64
+
+
+@pytest_asyncio.fixture
+async def server():
+    # Serves BODY with Range support; state['offset'] shifts where a 206
+    # claims to start and state['etag'] is the file's current ETag
+    state = {'offset': 0, 'etag': '"v1"', 'requests': []}
+
+    async def handle(request):
+        state['requests'].append(dict(request.headers))
+        rng = request.headers.get('Range')
+        if rng is not None and request.headers.get('If-Range') == \
+                state['etag']:
+            start = int(rng[6:-1]) + state['offset']
+            return web.Response(status=206, body=BODY[start:], headers={
+                'ETag': state['etag'],
+                'Content-Range': f'bytes {start}-{len(BODY) - 1}/'
+                                 f'{len(BODY)}'})
+        return web.Response(body=BODY, headers={'ETag': state['etag']})
+
+    app = web.Application()
+    app.router.add_get('/file.pdf', handle)
+    server = TestServer(app)
+    await server.start_server()
+    server.state = state
+    yield server
+    await server.close()
+
+
+@pytest_asyncio.fixture
+async def downloader(tmp_path):
+    async with aiohttp.ClientSession() as session:
+        yield Downloader(session, tmp_path.joinpath('partial'))
+
+
+def _interrupted(downloader, url, size, validator='"v1"'):
+    downloader.root.mkdir(parents=True, exist_ok=True)
+    partial = downloader._partial(url)
+    partial.write_bytes(BODY[:size])
+    if validator is not None:
+        downloader._validator(partial).write_text(validator)
+    return partial
+
+
+async def test_resumes_with_if_range(server, downloader):
+    url = str(server.make_url('/file.pdf'))
+    _interrupted(downloader, url, 1000)
+    download = await downloader.fetch(url)
+    assert download.blob == hashlib.sha256(BODY).hexdigest()
+    headers = server.state['requests'][0]
+    assert headers['Range'] == 'bytes=1000-'
+    assert headers['If-Range'] == '"v1"'
+    assert not downloader._validator(download.path).exists()
+
+
+async def test_changed_file_is_fetched_again(server, downloader):
+    url = str(server.make_url('/file.pdf'))
+    _interrupted(downloader, url, 1000)
+    server.state['etag'] = '"v2"'
+    download = await downloader.fetch(url)
+    assert download.blob == hashlib.sha256(BODY).hexdigest()
+    assert download.size == len(BODY)
+
+
+async def test_misplaced_range_starts_over(server, downloader):
+    url = str(server.make_url('/file.pdf'))
+    _interrupted(downloader, url, 1000)
+    server.state['offset'] = 10
+    download = await downloader.fetch(url)
+    assert download.blob == hashlib.sha256(BODY).hexdigest()
+    assert 'Range' not in server.state['requests'][-1]
+
+
+async def test_partial_without_validator_is_not_resumed(server, downloader):
+    url = str(server.make_url('/file.pdf'))
+    _interrupted(downloader, url, 1000, validator=None)
+    download = await downloader.fetch(url)
+    assert download.blob == hashlib.sha256(BODY).hexdigest()
+    assert 'Range' not in server.state['requests'][0]
+
+
+async def test_locks_are_dropped_after_use(server, downloader):
+    url = str(server.make_url('/file.pdf'))
+    await downloader.fetch(url)
+    assert downloader._locks == {}
+
+
+async def test_adopted_blob_is_collected_unless_retained(server, downloader,
+                                                         tmp_path):
+    db = MetaDB(str(tmp_path.joinpath('meta.db')))
+    store = BlobStore(db, tmp_path.joinpath('blobs'))
+    download = await downloader.fetch(str(server.make_url('/file.pdf')))
+    blob = await store.adopt(download.path, download.blob, download.size)
+    assert store.path(blob).exists()
+    assert await store.gc() == 1
+    assert not store.path(blob).exists()
+    await db.close()
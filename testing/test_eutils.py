@@ -0,0 +1,56 @@
+from aio_eutils import parse_efetch, EUtils
+from aio_http import RequestError
+import pytest
+
+EFETCH = b'''<?xml version="1.0" ?>
+<PubmedArticleSet>
+<PubmedArticle>
+  <MedlineCitation><PMID Version="1">123</PMID><Article>
+    <Journal><Title>Journal of Tests</Title><JournalIssue><PubDate>
+      <Year>2019</Year><Month>Mar</Month><Day>7</Day>
+    </PubDate></JournalIssue></Journal>
+    <ArticleTitle>A study of <i>things</i>.</ArticleTitle>
+    <AuthorList>
+      <Author><LastName>Smith</LastName><ForeName>Ann</ForeName></Author>
+      <Author><LastName>Jones</LastName></Author>
+      <Author><CollectiveName>The Test Group</CollectiveName></Author>
+    </AuthorList>
+  </Article></MedlineCitation>
+  <PubmedData><ArticleIdList>
+    <ArticleId IdType="pubmed">123</ArticleId>
+    <ArticleId IdType="doi">10.1000/ABC</ArticleId>
+  </ArticleIdList></PubmedData>
+</PubmedArticle>
+<PubmedArticle>
+  <MedlineCitation><PMID>456</PMID><Article>
+    <Journal><Title>Old Journal</Title><JournalIssue><PubDate>
+      <MedlineDate>1998 Dec-1999 Jan</MedlineDate>
+    </PubDate></JournalIssue></Journal>
+    <ArticleTitle>Untitled</ArticleTitle>
+  </Article></MedlineCitation>
+</PubmedArticle>
+</PubmedArticleSet>'''
+
+
+def test_parse_efetch():
+    first, second = parse_efetch(EFETCH)
+    assert first == {'doi': '10.1000/ABC', 'pmid': '123',
+                     'title': 'A study of things',
+                     'authors': ['Ann Smith', 'Jones', 'The Test Group'],
+                     'journal': 'Journal of Tests',
+                     'date': '2019-03-07T00:00:00'}
+    assert second['doi'] is None and second['authors'] == []
+    assert second['date'] == '1998-12-01T00:00:00'
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('body', [b'{"error": "API key invalid"}',
+                                  b'<html>Service unavailable<br></html>'])
+async def test_error_bodies_are_request_errors(body):
+    async def get(url, params=None):
+        return body
+
+    with pytest.raises(RequestError):
+        await EUtils(get).search('term')
+    with pytest.raises(RequestError):
+        await EUtils(get).fetch(['1'])
@@ -0,0 +1,43 @@
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from aio_proxy import AIOProxy
+
+pytestmark = [pytest.mark.asyncio]
+
+DATA = b'%PDF-1.4 ' + bytes(range(256)) * 16
+
+
+@pytest_asyncio.fixture
+async def client(tmp_path):
+    path = tmp_path.joinpath('f.pdf')
+    path.write_bytes(DATA)
+    proxy = AIOProxy.__new__(AIOProxy)
+
+    async def handle(request):
+        return proxy._file_response(request, path, 'application/pdf')
+
+    app = web.Application()
+    app.router.add_get('/file', handle)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    yield client
+    await client.close()
+
+
+async def test_revalidation_with_the_sent_etag(client):
+    response = await client.get('/file')
+    assert response.status == 200
+    assert await response.read() == DATA
+    assert response.headers['Content-Type'] == 'application/pdf'
+    etag = response.headers['ETag']
+    response = await client.get('/file', headers={'If-None-Match': etag})
+    assert response.status == 304
+    assert response.headers['ETag'] == etag
+
+
+async def test_range(client):
+    response = await client.get('/file', headers={'Range': 'bytes=9-12'})
+    assert response.status == 206
+    assert await response.read() == DATA[9:13]
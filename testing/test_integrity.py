@@ -0,0 +1,75 @@
+import os
+import json
+import time
+import pytest
+import pytest_asyncio
+import aio_articleparser as ap
+from aio_metadb import MetaDB
+from aio_blobstore import BlobStore
+
+pytestmark = [pytest.mark.asyncio]
+
+
+@pytest_asyncio.fixture
+async def article(tmp_path):
+    db = MetaDB(str(tmp_path.joinpath('meta.db')))
+    article = ap.Article(None, {}, {}, db=db,
+                         store=BlobStore(db, tmp_path.joinpath('blobs')))
+    article.path = tmp_path.joinpath('article')
+    article.path.mkdir()
+    article.files = {}
+    article.manifest = {'files': {}}
+    article.checks = 0
+    verify = article._verify_integrity
+
+    async def counted():
+        article.checks += 1
+        return await verify()
+    article._verify_integrity = counted
+    yield article
+    await db.close()
+
+
+def _write_content(article, content, later=0):
+    path = article.path.joinpath('content.json')
+    path.write_text(json.dumps(content))
+    if later:
+        stamp = time.time() + later
+        os.utime(path, (stamp, stamp))
+
+
+SECTION = [{'title': 'Introduction', 'content': 'Some text'}]
+
+
+async def test_repeated_checks_are_answered_from_memory(article):
+    _write_content(article, SECTION)
+    first = await article.verify_integrity()
+    assert first['content'] and not first['references']
+    assert await article.verify_integrity() == first
+    assert article.checks == 1
+
+
+async def test_disk_changes_show_after_the_recheck_window(article):
+    _write_content(article, SECTION)
+    assert (await article.verify_integrity())['content']
+    _write_content(article, [], later=10)
+    # Within INTEGRITY_RECHECK the files are not even stat'ed
+    assert (await article.verify_integrity())['content']
+    article.INTEGRITY_RECHECK = 0
+    assert not (await article.verify_integrity())['content']
+    assert article.checks == 2
+
+
+async def test_unchanged_files_are_not_read_again(article):
+    article.INTEGRITY_RECHECK = 0
+    _write_content(article, SECTION)
+    await article.verify_integrity()
+    await article.verify_integrity()
+    assert article.checks == 1
+
+
+async def test_changes_through_the_article_drop_the_result(article):
+    await article.verify_integrity()
+    article.add_content([{'title': 'Abstract', 'content': 'Summary'}])
+    assert (await article.verify_integrity())['abstract']
+    assert article.checks == 2
@@ -0,0 +1,115 @@
+import sqlite3
+import pytest
+import pytest_asyncio
+from aio_metadb import MetaDB
+
+pytestmark = [pytest.mark.asyncio]
+
+
+def _entry(**fields):
+    return {'doi': None, 'pmid': None, 'title': None, 'authors': None,
+            'journal': None, 'date': None, 'local': False, **fields}
+
+
+@pytest_asyncio.fixture
+async def db(tmp_path):
+    db = MetaDB(str(tmp_path.joinpath('meta.db')))
+    yield db
+    await db.close()
+
+
+async def _rows(db):
+    conn = await db.connect()
+    async with conn.execute(f'SELECT doi, pmid, title FROM {db.TABLE} '
+                            'ORDER BY rowid') as cursor:
+        return await cursor.fetchall()
+
+
+async def test_migrations_drop_duplicates_and_run_once(tmp_path):
+    location = str(tmp_path.joinpath('meta.db'))
+    conn = sqlite3.connect(location)
+    conn.execute(MetaDB.SQL_CREATE)
+    conn.executemany(f'INSERT INTO {MetaDB.TABLE} (doi, pmid, title) '
+                     'VALUES (?, ?, ?)', [('10.1/a', 1, 'old'),
+                                          ('10.1/a', 1, 'new'),
+                                          (None, 2, 'b')])
+    conn.commit()
+    conn.close()
+    db = MetaDB(location)
+    assert await _rows(db) == [('10.1/a', 1, 'new'), (None, 2, 'b')]
+    conn = await db.connect()
+    async with conn.execute('PRAGMA user_version') as cursor:
+        assert await cursor.fetchone() == (len(MetaDB.MIGRATIONS),)
+    await db.close()
+    db = MetaDB(location)
+    assert await _rows(db) == [('10.1/a', 1, 'new'), (None, 2, 'b')]
+    await db.close()
+
+
+async def test_upsert_merges_and_replaces(db):
+    await db.upsert(_entry(doi='10.1/a', title='A', journal='J'))
+    await db.upsert(_entry(doi='10.1/a', pmid='1'))
+    entry, key = await db.get({'pmid': '1'})
+    assert key == 'pmid'
+    assert (entry['doi'], entry['title'], entry['journal']) == \
+        ('10.1/a', 'A', 'J')
+    await db.upsert(_entry(doi='10.1/a', title='B'), overwrite=True)
+    entry, _ = await db.get({'doi': '10.1/a'})
+    assert (entry['pmid'], entry['title'], entry['journal']) == \
+        (None, 'B', None)
+
+
+async def test_upsert_without_identifier_is_ignored(db):
+    await db.upsert(_entry(title='A'))
+    assert await _rows(db) == []
+
+
+async def test_get_many(db):
+    await db.upsert(_entry(doi='10.1/a', pmid='1'))
+    await db.upsert(_entry(doi='10.1/b', pmid='2'))
+    assert set(await db.get_many(['10.1/a', '10.1/b', '10.1/c'])) == \
+        {'10.1/a', '10.1/b'}
+    assert set(await db.get_many(['2', None], key='pmid')) == {'2'}
+
+
+async def test_upsert_joins_doi_and_pmid_rows(db):
+    await db.upsert(_entry(doi='10.1/a', title='A'))
+    await db.upsert(_entry(pmid='1', journal='J', authors=['Ann Smith']))
+    await db.upsert(_entry(doi='10.1/a', pmid='1'))
+    assert await _rows(db) == [('10.1/a', 1, 'A')]
+    entry, _ = await db.get({'doi': '10.1/a'})
+    assert entry['journal'] == 'J' and entry['authors'] == ['Ann Smith']
+
+
+async def test_upsert_moves_pmid_from_another_doi(db):
+    await db.upsert(_entry(doi='10.1/a', title='A'))
+    await db.upsert(_entry(doi='10.1/b', pmid='1', title='B'))
+    await db.upsert(_entry(doi='10.1/a', pmid='1'))
+    assert await _rows(db) == [('10.1/a', 1, 'A'), ('10.1/b', None, 'B')]
+
+async def test_dois_match_in_any_case(db):
+    await db.upsert(_entry(doi='10.1/ABC', pmid='1', local=True))
+    entry, key = await db.get({'doi': '10.1/abc'})
+    assert key == 'doi' and entry['doi'] == '10.1/ABC'
+    assert list(await db.get_many(['10.1/Abc'])) == ['10.1/Abc']
+    await db.upsert(_entry(doi='10.1/abc', title='A'))
+    (row,) = await _rows(db)
+    assert row[0].lower() == '10.1/abc' and row[1:] == (1, 'A')
+
+
+async def test_migration_joins_dois_differing_in_case(tmp_path):
+    location = str(tmp_path.joinpath('meta.db'))
+    conn = sqlite3.connect(location)
+    conn.execute(f'CREATE TABLE {MetaDB.TABLE} (' +
+                 MetaDB.SQL_COLUMNS.replace(' COLLATE NOCASE', '') + ')')
+    conn.executemany(f'INSERT INTO {MetaDB.TABLE} (doi, pmid, title, local) '
+                     'VALUES (?, ?, ?, ?)', [('10.1/A', 1, 'local', 'T'),
+                                             ('10.1/a', None, 'new', 'F'),
+                                             ('10.1/b', 2, 'b', 'F')])
+    conn.execute(f'PRAGMA user_version = {len(MetaDB.MIGRATIONS) - 1}')
+    conn.commit()
+    conn.close()
+    db = MetaDB(location)
+    assert await _rows(db) == [('10.1/A', 1, 'local'), ('10.1/b', 2, 'b')]
+    assert (await db.get({'doi': '10.1/a'}))[0]['local']
+    await db.close()
@@ -0,0 +1,20 @@
+from aio_proxy import PageHead
+
+
+def test_page_head():
+    body = (b'<html><HEAD><title> Article &amp; more | ScienceDirect'
+            b'</title>\n<meta name="citation_doi" content="10.1/a">'
+            b"<meta property='og:site_name' content='OUP Academic' />"
+            b'<meta content=Nature name=application-name>'
+            b'</head ><body><title>not this</title></body></html>')
+    head = PageHead(body)
+    assert head.title == 'Article & more | ScienceDirect'
+    assert head.meta == {'citation_doi': '10.1/a',
+                         'og:site_name': 'OUP Academic',
+                         'application-name': 'Nature'}
+    assert body[head.end:].startswith(b'</head')
+
+
+def test_page_head_without_head():
+    head = PageHead(b'<p>no head here</p>')
+    assert head.end == -1 and head.title is None and head.meta == {}
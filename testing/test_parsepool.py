@@ -0,0 +1,19 @@
+from aio_parsepool import ParsePool
+
+
+def test_default_workers_are_capped(monkeypatch):
+    monkeypatch.setattr(ParsePool, 'WORKERS', None)
+    monkeypatch.setattr('os.cpu_count', lambda: 64)
+    assert ParsePool().workers == ParsePool.MAX_WORKERS
+    monkeypatch.setattr('os.cpu_count', lambda: 2)
+    assert ParsePool().workers == 2
+    monkeypatch.setattr('os.cpu_count', lambda: None)
+    assert ParsePool().workers == 1
+
+
+def test_workers_can_be_set(monkeypatch):
+    monkeypatch.setattr('os.cpu_count', lambda: 64)
+    monkeypatch.setattr(ParsePool, 'WORKERS', '16')
+    assert ParsePool().workers == 16
+    assert ParsePool(8).workers == 8
+    assert ParsePool(0).workers == 0
@@ -0,0 +1,69 @@
+import json
+import pytest
+import pytest_asyncio
+import aio_articleparser as ap
+from aio_assets import CompressedBody
+from aio_blobstore import BlobStore
+from aio_metadb import MetaDB
+from aio_sections import JsonSectionStore
+
+pytestmark = [pytest.mark.asyncio]
+
+CONTENT = [{'title': 'Abstract', 'content': 'Summary'}]
+
+
+def encode(obj):
+    return CompressedBody(json.dumps(obj).encode('utf-8'))
+
+
+@pytest_asyncio.fixture
+async def article(tmp_path):
+    db = MetaDB(str(tmp_path.joinpath('meta.db')))
+    sections = JsonSectionStore()
+
+    # A store whose signature never changes, as when a rewrite lands
+    # within the file system's timestamp resolution
+    async def signature(path, names):
+        return tuple(1 for _ in names)
+    sections.signature = signature
+    article = ap.Article(None, {}, {}, db=db,
+                         store=BlobStore(db, tmp_path.joinpath('blobs')),
+                         sections=sections)
+    article.path = tmp_path.joinpath('article')
+    article.manifest = {'files': {}}
+
+    async def check_local():
+        pass
+    article.check_local = check_local
+    yield article
+    await db.close()
+
+
+async def test_payloads_are_reused(article):
+    article.content = CONTENT
+    await article.save()
+    first = await article.payload('content', encode)
+    assert await article.payload('content', encode) is first
+    assert article.resident_size() == first.size
+
+
+async def test_saving_drops_the_payload(article):
+    article.content = CONTENT
+    await article.save()
+    await article.payload('content', encode)
+    article.content = CONTENT + CONTENT
+    await article.save()
+    payload = await article.payload('content', encode)
+    assert json.loads(payload.body) == CONTENT + CONTENT
+
+
+async def test_flushing_figures_drops_the_payload(article):
+    article._figures = {'pdf': {'name': 'a.pdf'}}
+    article._figures_dirty = True
+    await article.flush()
+    await article.payload('figures', encode)
+    article._figures = {'pdf': {'name': 'b.pdf'}}
+    article._figures_dirty = True
+    await article.flush()
+    payload = await article.payload('figures', encode)
+    assert json.loads(payload.body) == {'pdf': {'name': 'b.pdf'}}
@@ -0,0 +1,273 @@
+import gzip
+import json
+import aiohttp
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from aio_articleparser import Article, ArticleItem
+from aio_assets import AssetCache
+from aio_blobstore import BlobStore
+from aio_download import DownloadError
+from aio_http import HttpClient
+from aio_metadb import MetaDB
+from aio_proxy import AIOProxy, ProxyContext, PyrCache
+from aio_sections import JsonSectionStore
+
+pytestmark = [pytest.mark.asyncio]
+
+DATA = bytes(range(256)) * (AIOProxy.PROXY_CHUNK_SIZE // 64 + 3)
+PREFIX = AIOProxy.CONTEXT_PREFIX + 'tab'
+PAGE = (b'<html><head><title>Test</title></head>'
+        b'<body><p>Hello</p></body></html>')
+
+
+@pytest_asyncio.fixture
+async def upstream(tmp_path):
+    # The publisher: its page sets a cookie, and the cookies each request
+    # for /file.pdf came with are kept in upstream.file_cookies
+    path = tmp_path.joinpath('big.pdf')
+    path.write_bytes(DATA)
+    file_cookies = []
+
+    async def big(request):
+        return web.FileResponse(path)
+
+    async def page(request):
+        response = web.Response(body=gzip.compress(PAGE),
+                                content_type='text/html',
+                                headers={'Content-Encoding': 'gzip'})
+        response.set_cookie('publisher', 'abc')
+        return response
+
+    async def file(request):
+        file_cookies.append(dict(request.cookies))
+        return web.Response(body=b'%PDF-1.4 ' + DATA,
+                            content_type='application/pdf')
+
+    app = web.Application()
+    app.router.add_get('/big.pdf', big)
+    app.router.add_get('/page', page)
+    app.router.add_get('/file.pdf', file)
+    upstream = TestServer(app)
+    await upstream.start_server()
+    upstream.file_cookies = file_cookies
+    yield upstream
+    await upstream.close()
+
+
+@pytest_asyncio.fixture
+async def proxy(upstream):
+    # Cookies for IP addresses are only kept by an unsafe jar
+    session = aiohttp.ClientSession(
+        auto_decompress=False, cookie_jar=aiohttp.CookieJar(unsafe=True))
+    context = ProxyContext('tab', session)
+    context.origin = f'http://{upstream.host}:{upstream.port}'
+    proxy = AIOProxy.__new__(AIOProxy)
+    proxy.assets = AssetCache()
+    proxy.contexts = PyrCache(1)
+    proxy.contexts[context.key] = context
+    yield proxy
+    await session.close()
+
+
+@pytest_asyncio.fixture
+async def client(proxy):
+    app = web.Application()
+    app.router.add_get('/{tail:.*}', proxy.proxy)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    yield client
+    await client.close()
+
+
+@pytest_asyncio.fixture
+async def tabs():
+    # A proxy that opens its contexts through /pyreadproxy
+    proxy = AIOProxy.__new__(AIOProxy)
+    proxy.assets = AssetCache()
+    proxy.http = HttpClient()
+    proxy.contexts = PyrCache(AIOProxy.MAX_CONTEXTS,
+                              on_evict=lambda _, c: c.close())
+    app = web.Application()
+    app.router.add_get('/{tail:.*}', proxy.handler)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    client.proxy = proxy
+    yield client
+    await client.close()
+    for context in proxy.contexts.values():
+        await context.session.close()
+    await proxy.http.close()
+
+
+async def _open(client, location):
+    response = await client.get('/pyreadproxy', params={'location': location},
+                                allow_redirects=False)
+    assert response.status == 302
+    return response.headers['Location']
+
+
+async def test_large_body_is_streamed_intact(client):
+    response = await client.get(PREFIX + '/big.pdf')
+    assert response.status == 200
+    assert await response.read() == DATA
+    assert response.headers['Content-Type'] == 'application/pdf'
+    assert response.headers['Content-Length'] == str(len(DATA))
+    assert 'Last-Modified' in response.headers
+
+
+async def test_range_is_forwarded(client):
+    response = await client.get(PREFIX + '/big.pdf',
+                                headers={'Range': 'bytes=100-199'})
+    assert response.status == 206
+    assert await response.read() == DATA[100:200]
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(DATA)}'
+
+
+async def test_html_is_decoded_and_scripts_injected(client):
+    response = await client.get(PREFIX + '/page')
+    assert response.status == 200
+    body = await response.read()
+    assert b'<title>Test</title>' in body
+    assert b'pyreadscrape.js' in body
+    assert body.index(b'pyreadscrape.js') < body.index(b'</head>')
+
+
+async def test_files_are_fetched_with_the_cookies_set_while_proxying(
+        client, proxy, upstream, tmp_path):
+    context = proxy.contexts['tab']
+    context.cookies = {'reader': 'r'}
+    await client.get(PREFIX + '/page')
+    db = MetaDB(str(tmp_path.joinpath('meta.db')))
+    async with aiohttp.ClientSession() as session:
+        article = Article(None, {}, {}, db=db,
+                          store=BlobStore(db, tmp_path.joinpath('blobs')),
+                          sections=JsonSectionStore(),
+                          download_session=session)
+        article.path = tmp_path.joinpath('article')
+        article.path.mkdir()
+        article.files = {}
+        article.manifest = {'files': {}}
+
+        async def check_local():
+            pass
+        article.check_local = check_local
+        article._schedule_flush = lambda: None
+        await proxy._add_file(article, context,
+                              str(upstream.make_url('/file.pdf')),
+                              identity=ArticleItem.PDF, title='pdf')
+    await db.close()
+    assert upstream.file_cookies == [{'reader': 'r', 'publisher': 'abc'}]
+    assert 'file.pdf' in article.files
+
+
+async def test_each_tab_gets_a_context_of_its_own(tabs, upstream):
+    first = await _open(tabs, str(upstream.make_url('/page')))
+    second = await _open(tabs, str(upstream.make_url('/page')))
+    assert first != second
+    for location in (first, second):
+        key, path = tabs.proxy._split_path(location)
+        assert path == '/page'
+        assert tabs.proxy.contexts[key].origin == \
+            f'http://{upstream.host}:{upstream.port}'
+    # The cookie names the tab opened last
+    cookies = tabs.session.cookie_jar.filter_cookies(tabs.make_url('/'))
+    assert cookies[AIOProxy.CONTEXT_COOKIE].value == \
+        tabs.proxy._split_path(second)[0]
+    response = await tabs.get(first)
+    assert response.status == 200
+    assert b'pyreadscrape.js' in await response.read()
+
+
+async def test_subresources_are_fetched_from_the_referring_tab(tabs,
+                                                               upstream):
+    page = await _open(tabs, str(upstream.make_url('/page')))
+    # Opened last, so the cookie names this one
+    await _open(tabs, 'http://localhost:1/page')
+    for mode in ({'Sec-Fetch-Mode': 'no-cors'}, {'Accept': '*/*'}):
+        response = await tabs.get('/big.pdf', allow_redirects=False,
+                                  headers={'Referer': str(tabs.make_url(page)),
+                                           **mode})
+        assert response.status == 200
+        assert await response.read() == DATA
+
+
+async def test_only_navigations_are_redirected(tabs, upstream):
+    page = await _open(tabs, str(upstream.make_url('/page')))
+    referer = {'Referer': str(tabs.make_url(page))}
+    for headers in ({'Sec-Fetch-Mode': 'navigate'},
+                    {'Accept': 'text/html,*/*;q=0.8'}):
+        response = await tabs.get('/page?a=1', allow_redirects=False,
+                                  headers={**referer, **headers})
+        assert response.status == 307
+        assert response.headers['Location'] == \
+            page.replace('/page', '/page?a=1')
+    response = await tabs.get('/page', allow_redirects=False,
+                              headers={**referer, 'Sec-Fetch-Mode': 'cors',
+                                       'Accept': 'text/html'})
+    assert response.status == 200
+
+
+async def test_unknown_tabs_are_not_found(tabs, upstream):
+    await _open(tabs, str(upstream.make_url('/page')))
+    response = await tabs.get(AIOProxy.CONTEXT_PREFIX + 'gone/page')
+    assert response.status == 404
+
+
+class FakeArticle:
+
+    def __init__(self, errors):
+        self.errors = errors
+        self.added = []
+
+    async def a_init(self, doi):
+        return {'doi': doi}
+
+    async def add_file(self, source, **kwargs):
+        if source in self.errors:
+            raise self.errors[source]
+        self.added.append(source)
+
+    async def flush(self):
+        pass
+
+
+async def _scrape_files(article, files):
+    proxy = AIOProxy.__new__(AIOProxy)
+    proxy.contexts = PyrCache(1)
+    proxy.cache = PyrCache(1)
+    proxy.cache['10.1/a'] = article
+    app = web.Application()
+    app.router.add_post('/pyreadscrapi', proxy.pyreadscrapi)
+    async with TestClient(TestServer(app)) as client:
+        response = await client.post('/pyreadscrapi',
+                                     json={'doi': '10.1/a', 'files': files})
+        return response.status, await response.read()
+
+
+async def test_failed_files_are_reported():
+    article = FakeArticle({'https://x.org/a.pdf': DownloadError('403'),
+                           'https://x.org/b.pdf': FileExistsError()})
+    status, body = await _scrape_files(article, {
+        'pdf': 'https://x.org/a.pdf', 'extended': 'https://x.org/b.pdf',
+        'data': 'https://x.org/c.zip'})
+    assert status == 200
+    assert json.loads(body) == {
+        'item': 'files', 'status': 'error',
+        'errors': {'https://x.org/a.pdf': "DownloadError('403')"}}
+    assert article.added == ['https://x.org/c.zip']
+
+
+async def test_files_without_errors_are_a_success():
+    status, body = await _scrape_files(FakeArticle({}), {
+        'pdf': 'https://x.org/a.pdf'})
+    assert status == 200
+    assert json.loads(body) == {'item': 'files', 'status': 'success',
+                                'errors': {}}
+
+
+async def test_unexpected_errors_are_not_swallowed():
+    article = FakeArticle({'https://x.org/a.pdf': ValueError('bug')})
+    status, _ = await _scrape_files(article, {'pdf': 'https://x.org/a.pdf'})
+    assert status == 500
@@ -0,0 +1,92 @@
+import aiohttp
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+import aio_articleparser as ap
+from aio_metadb import MetaDB
+from aio_parsepool import ParsePool
+
+pytestmark = [pytest.mark.asyncio]
+
+EFETCH = b'''<PubmedArticleSet><PubmedArticle>
+<MedlineCitation><PMID>1</PMID><Article>
+<Journal><Title>Journal A</Title><JournalIssue><PubDate>
+<Year>2001</Year><Month>Feb</Month><Day>3</Day></PubDate></JournalIssue>
+</Journal><ArticleTitle>Article A.</ArticleTitle>
+<AuthorList><Author><LastName>Smith</LastName><ForeName>Ann</ForeName>
+</Author></AuthorList></Article></MedlineCitation>
+<PubmedData><ArticleIdList><ArticleId IdType="doi">10.1/a</ArticleId>
+</ArticleIdList></PubmedData></PubmedArticle></PubmedArticleSet>'''
+
+WORKS = {'message': {'items': [
+    {'DOI': '10.1/b', 'title': ['Article B'], 'container-title': ['B'],
+     'author': [{'given': 'Bo', 'family': 'Berg'}],
+     'created': {'date-time': '2002-03-04T00:00:00Z'}}]}}
+
+
+@pytest_asyncio.fixture
+async def stub():
+    # EUtils and Crossref on one local server, recording what is asked
+    requests = []
+
+    async def esearch(request):
+        requests.append(('esearch', request.query['term']))
+        ids = ['1'] if '"10.1/a"[aid]' in request.query['term'] else []
+        return web.json_response({'esearchresult': {'idlist': ids}})
+
+    async def efetch(request):
+        requests.append(('efetch', request.query['id']))
+        return web.Response(body=EFETCH if request.query['id'] == '1'
+                            else b'<PubmedArticleSet/>')
+
+    async def works(request):
+        requests.append(('works', request.query['filter']))
+        return web.json_response(WORKS)
+
+    app = web.Application()
+    app.router.add_get('/eutils/esearch.fcgi', esearch)
+    app.router.add_get('/eutils/efetch.fcgi', efetch)
+    app.router.add_get('/works', works)
+    server = TestServer(app)
+    await server.start_server()
+    yield server, requests
+    await server.close()
+
+
+@pytest_asyncio.fixture
+async def article(tmp_path, stub):
+    server, _ = stub
+    db = MetaDB(str(tmp_path.joinpath('meta.db')))
+    session = aiohttp.ClientSession()
+    article = ap.Article(session, {}, {}, db=db, parser=ParsePool(0))
+    article.eutils.base_url = str(server.make_url('/eutils/'))
+    article.crossref.base_url = str(server.make_url('/'))
+    yield article
+    await session.close()
+    await db.close()
+
+
+async def test_references_not_in_pubmed_go_to_crossref_in_one_batch(
+        article, stub):
+    _, requests = stub
+    refs = [{'doi': '10.1/a'}, {'doi': '10.1/B'}, {'doi': '10.1/c'}, None]
+    resolved = await article._resolve_references(refs)
+    assert resolved[0]['title'] == 'Article A'
+    assert resolved[0]['pmid'] == '1'
+    assert resolved[1]['title'] == 'Article B'
+    assert resolved[1]['authors'] == ['Bo Berg']
+    # Nobody knows 10.1/c, so it is left to fetch_metadata
+    assert 2 not in resolved and 3 not in resolved
+    works = [r for kind, r in requests if kind == 'works']
+    assert works == ['doi:10.1/b,doi:10.1/c']
+
+
+async def test_resolved_references_are_kept(article, stub):
+    _, requests = stub
+    await article._resolve_references([{'doi': '10.1/a'}, {'doi': '10.1/b'}])
+    del requests[:]
+    resolved = await article._resolve_references([{'doi': '10.1/a'},
+                                                  {'doi': '10.1/b'}])
+    assert sorted(resolved) == [0, 1]
+    assert requests == []
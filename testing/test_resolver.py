@@ -0,0 +1,113 @@
+import asyncio
+from datetime import timedelta
+import aiohttp
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from aio_metadb import MetaDB
+from aio_resolver import DoiResolver
+
+pytestmark = [pytest.mark.asyncio]
+
+
+@pytest_asyncio.fixture
+async def doi_org():
+    # /10.1/<name> redirects to /landing/<name> on this server, except
+    # 10.1/js*, whose landing pages are on a host we do not support
+    hits = []
+
+    async def resolve(request):
+        name = request.match_info['name']
+        hits.append(name)
+        await asyncio.sleep(0.01)
+        if name.startswith('js'):
+            raise web.HTTPFound('http://localhost:1/redirecting')
+        raise web.HTTPFound(f'/landing/{name}')
+
+    async def landing(request):
+        return web.Response(text='article')
+
+    app = web.Application()
+    app.router.add_get('/10.1/{name}', resolve)
+    app.router.add_get('/landing/{name}', landing)
+    server = TestServer(app)
+    await server.start_server()
+    server.hits = hits
+    yield server
+    await server.close()
+
+
+@pytest_asyncio.fixture
+async def resolver(tmp_path, doi_org):
+    db = MetaDB(str(tmp_path.joinpath('meta.db')))
+    browser = []
+
+    async def browser_resolve(doi):
+        browser.append(doi)
+        if doi == '10.1/js-crash':
+            raise RuntimeError('session died')
+        return str(doi_org.make_url('/landing/from-browser'))
+
+    async with aiohttp.ClientSession() as session:
+        resolver = DoiResolver(session, db, [doi_org.host],
+                               browser_resolve=browser_resolve)
+        resolver.DOI_URL = str(doi_org.make_url('/'))
+        resolver.browser = browser
+        yield resolver
+    await db.close()
+
+
+async def test_redirects_are_followed_and_remembered(resolver, doi_org):
+    url = str(doi_org.make_url('/landing/a'))
+    assert await resolver.resolve('10.1/a') == url
+    assert await resolver.resolve('10.1/A') == url
+    assert doi_org.hits == ['a'] and resolver.browser == []
+
+
+async def test_concurrent_resolves_share_one_request(resolver, doi_org):
+    urls = await asyncio.gather(*[resolver.resolve('10.1/a')
+                                  for _ in range(5)])
+    assert len(set(urls)) == 1 and doi_org.hits == ['a']
+
+
+async def test_unsupported_landing_page_goes_to_the_browser(resolver,
+                                                            doi_org):
+    url = str(doi_org.make_url('/landing/from-browser'))
+    assert await resolver.resolve('10.1/js') == url
+    assert resolver.browser == ['10.1/js']
+    assert await resolver.resolve('10.1/js') == url
+    assert resolver.browser == ['10.1/js']
+
+
+async def test_old_entries_are_resolved_again(resolver, doi_org):
+    resolver.MAX_AGE = timedelta(0)
+    await resolver.resolve('10.1/a')
+    await resolver.resolve('10.1/a')
+    assert doi_org.hits == ['a', 'a']
+
+
+async def test_supported_hosts(resolver):
+    resolver.capabilities = ['nature.com']
+    assert resolver.supported('https://www.nature.com/articles/x')
+    assert resolver.supported('https://nature.com/articles/x')
+    assert not resolver.supported('https://notnature.com/articles/x')
+
+
+async def test_failures_are_remembered_for_a_while(resolver, doi_org):
+    assert await resolver.resolve('10.1/js-crash') is None
+    assert await resolver.resolve('10.1/js-crash') is None
+    assert doi_org.hits == ['js-crash']
+    assert resolver.browser == ['10.1/js-crash']
+    resolver.FAILED_MAX_AGE = timedelta(0)
+    assert await resolver.resolve('10.1/js-crash') is None
+    assert doi_org.hits == ['js-crash', 'js-crash']
+
+
+async def test_unsupported_pages_without_a_browser_are_not_found(resolver,
+                                                                 doi_org):
+    resolver.browser_resolve = None
+    assert await resolver.resolve('10.1/js') is None
+    assert await resolver.resolve('10.1/js') is None
+    assert doi_org.hits == ['js']
+
@@ -0,0 +1,83 @@
+import os
+import pytest
+import pytest_asyncio
+from aio_metadb import MetaDB
+from aio_sections import (JsonSectionStore, SqliteSectionStore,
+                          migrate_sections, section_store)
+
+pytestmark = [pytest.mark.asyncio]
+
+CONTENT = [{'title': 'Abstract', 'content': 'Summary'}]
+
+
+@pytest_asyncio.fixture
+async def db(tmp_path):
+    db = MetaDB(str(tmp_path.joinpath('meta.db')))
+    yield db
+    await db.close()
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def store(request, db):
+    return section_store(request.param, db)
+
+
+async def test_read_write(store, tmp_path):
+    path = tmp_path.joinpath('files', '10.1', 'a')
+    assert await store.read(path, 'content') is None
+    assert not await store.exists(path, 'content')
+    await store.write(path, 'content', CONTENT)
+    assert await store.read(path, 'content') == CONTENT
+    assert await store.exists(path, 'content')
+
+
+async def test_signature_changes_on_write(store, tmp_path):
+    path = tmp_path.joinpath('a')
+    empty = await store.signature(path, ['content', 'figures'])
+    assert empty == (None, None)
+    await store.write(path, 'content', CONTENT)
+    first = await store.signature(path, ['content', 'figures'])
+    assert first[0] is not None and first[1] is None
+    await store.write(path, 'content', CONTENT + CONTENT)
+    assert await store.signature(path, ['content', 'figures']) != first
+
+
+async def test_json_signature_follows_the_size(tmp_path):
+    store = JsonSectionStore()
+    path = tmp_path.joinpath('a')
+    await store.write(path, 'content', CONTENT)
+    first = await store.signature(path, ['content'])
+    stat = path.joinpath('content.json').stat()
+    await store.write(path, 'content', CONTENT + CONTENT)
+    # Same timestamp, as a quick rewrite on a coarse file system gets
+    os.utime(path.joinpath('content.json'),
+             ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert await store.signature(path, ['content']) != first
+
+
+async def test_paths_are_articles_with_a_manifest(store, tmp_path):
+    root = tmp_path.joinpath('files')
+    await store.write(root.joinpath('a'), 'manifest', {'files': {}})
+    await store.write(root.joinpath('b'), 'content', CONTENT)
+    await store.write(tmp_path.joinpath('elsewhere'), 'manifest', {})
+    assert await store.paths(root) == [root.joinpath('a')]
+
+
+async def test_unknown_store():
+    with pytest.raises(ValueError):
+        section_store('xml', None)
+
+
+async def test_migrate_sections(db, tmp_path):
+    root = tmp_path.joinpath('files')
+    source = JsonSectionStore()
+    for name in ['a', 'b']:
+        await source.write(root.joinpath(name), 'manifest', {'doi': name})
+        await source.write(root.joinpath(name), 'content', CONTENT)
+    target = SqliteSectionStore(db)
+    assert await migrate_sections(source, target, root) == 2
+    assert sorted(await target.paths(root)) == [root.joinpath('a'),
+                                                root.joinpath('b')]
+    assert await target.read(root.joinpath('b'), 'manifest') == {'doi': 'b'}
+    assert await target.read(root.joinpath('b'), 'content') == CONTENT
+    assert await target.read(root.joinpath('b'), 'figures') is None
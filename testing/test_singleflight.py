@@ -0,0 +1,74 @@
+import asyncio
+import pytest
+from aio_throttle import SingleFlight
+
+pytestmark = [pytest.mark.asyncio]
+
+
+async def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    results = await asyncio.gather(*[flight.do(('doi', '10.1/a'), work)
+                                     for _ in range(5)])
+    assert results == ['result'] * 5
+    assert len(calls) == 1
+
+
+async def test_single_flight_keeps_different_keys_apart():
+    flight = SingleFlight()
+
+    def work(value):
+        async def run():
+            await asyncio.sleep(0.01)
+            return value
+        return run
+
+    a, b = await asyncio.gather(flight.do(('doi', '10.1/a'), work('a')),
+                                flight.do(('doi', '10.1/b'), work('b')))
+    assert (a, b) == ('a', 'b')
+
+
+async def test_single_flight_forgets_finished_calls():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        return len(calls)
+
+    assert await flight.do('k', work) == 1
+    await asyncio.sleep(0)
+    assert await flight.do('k', work) == 2
+    assert flight._calls == {}
+
+
+async def test_single_flight_cancelled_caller_does_not_cancel_others():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.02)
+        return 'done'
+
+    first = asyncio.ensure_future(flight.do('k', work))
+    second = asyncio.ensure_future(flight.do('k', work))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == 'done'
+
+
+async def test_single_flight_shares_exceptions():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0)
+        raise ValueError('boom')
+
+    results = await asyncio.gather(flight.do('k', work), flight.do('k', work),
+                                   return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
@@ -0,0 +1,54 @@
+import time
+import asyncio
+import pytest
+from aio_throttle import TokenBucket, HostLimiter, backoff
+
+pytestmark = [pytest.mark.asyncio]
+
+
+async def test_token_bucket_allows_burst_then_rate():
+    bucket = TokenBucket(20, burst=5)
+    start = time.monotonic()
+    for _ in range(5):
+        await bucket.acquire()
+    assert time.monotonic() - start < 0.05
+    for _ in range(4):
+        await bucket.acquire()
+    # Four more tokens at 20/s take about 0.2 s
+    assert time.monotonic() - start >= 0.15
+
+
+async def test_host_limiter_bounds_concurrency():
+    limiter = HostLimiter({'example.org': (None, 2)})
+    active = 0
+    peak = 0
+
+    async def request():
+        nonlocal active, peak
+        async with limiter.request('https://example.org/x'):
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+    await asyncio.gather(*[request() for _ in range(6)])
+    assert peak == 2
+
+
+async def test_host_limiter_keeps_hosts_apart():
+    limiter = HostLimiter({'a.org': (None, 1)}, default=(None, 1))
+    order = []
+
+    async def request(url, name):
+        async with limiter.request(url):
+            order.append(name)
+            await asyncio.sleep(0.02)
+
+    start = time.monotonic()
+    await asyncio.gather(request('https://a.org/1', 'a'),
+                         request('https://b.org/1', 'b'))
+    assert time.monotonic() - start < 0.035
+
+
+async def test_backoff_is_capped():
+    assert all(0 <= backoff(n, cap=2) <= 2 for n in range(20))